@@ -0,0 +1,148 @@
+import csv
+import hashlib
+
+from psycopg2.extras import RealDictCursor
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+BASE58_INDEX = {char: index for index, char in enumerate(BASE58_ALPHABET)}
+POLKADOT_PREFIX = 0
+KUSAMA_PREFIX = 2
+GENERIC_PREFIX = 42
+
+# column holding the 32-byte public key next to the SS58 address column
+ACCOUNT_KEY_COLUMN = 'account_key'
+# tables imported by the nightly export, their key is added during ingest
+ACCOUNT_KEY_TABLES = {
+    'dashboard': 'address',
+}
+
+
+def _checksum(payload):
+    return hashlib.blake2b(b'SS58PRE' + payload, digest_size=64).digest()[:2]
+
+
+def b58decode(value):
+    number = 0
+    for char in value:
+        number = number * 58 + BASE58_INDEX[char]
+    zeros = len(value) - len(value.lstrip('1'))
+    return b'\0' * zeros + number.to_bytes((number.bit_length() + 7) // 8, 'big')
+
+
+def b58encode(data):
+    number = int.from_bytes(data, 'big')
+    encoded = ''
+    while number:
+        number, remainder = divmod(number, 58)
+        encoded = BASE58_ALPHABET[remainder] + encoded
+    # leading zero bytes are encoded as '1'
+    return '1' * (len(data) - len(data.lstrip(b'\0'))) + encoded
+
+
+def account_key(address):
+    """Decode an SS58 address of any network to its 32-byte public key, raises ValueError if it isn't valid."""
+    try:
+        data = b58decode(address.strip())
+    except (KeyError, AttributeError):
+        raise ValueError(f"Invalid SS58 address {address}")
+    # prefixes 64-16383 take two bytes
+    prefix_length = 2 if data and data[0] & 0b0100_0000 else 1
+    if len(data) != prefix_length + 32 + 2:
+        raise ValueError(f"Invalid SS58 address length {address}")
+    if _checksum(data[:-2]) != data[-2:]:
+        raise ValueError(f"Invalid SS58 checksum {address}")
+    return data[prefix_length:-2]
+
+
+def try_account_key(address):
+    try:
+        return account_key(address)
+    except ValueError:
+        return None
+
+
+def ss58_encode(public_key, prefix=POLKADOT_PREFIX):
+    """Encode a 32-byte public key for a network prefix below 64, 0 is Polkadot."""
+    payload = bytes([prefix]) + public_key
+    return b58encode(payload + _checksum(payload))
+
+
+def strip_account_keys(rows):
+    """Drop the raw key from SELECT * rows before they are serialized."""
+    for row in rows:
+        row.pop(ACCOUNT_KEY_COLUMN, None)
+    return rows
+
+
+def add_account_keys(source, destination, address_column):
+    """Copy a CSV export from source to destination, appending the account key of address_column as bytea hex."""
+    reader = csv.reader(source)
+    writer = csv.writer(destination)
+    header = next(reader, None)
+    if header is None:
+        return
+    index = header.index(address_column)
+    writer.writerow(header + [ACCOUNT_KEY_COLUMN])
+    for row in reader:
+        key = try_account_key(row[index])
+        row.append('\\x' + key.hex() if key else '')
+        writer.writerow(row)
+
+
+def index_account_keys(db, table_name):
+    # imported tables are recreated every night, let postgres pick a free index name
+    with db.cursor() as cur:
+        cur.execute(f"CREATE INDEX ON {table_name} ({ACCOUNT_KEY_COLUMN})")
+    db.commit()
+
+
+def backfill_user_keys(db):
+    """Fill account_key for users registered before keys existed."""
+    with db.cursor() as cur:
+        cur.execute("CREATE TABLE IF NOT EXISTS users (user_id BIGINT PRIMARY KEY, polkadot_address TEXT, thread_id TEXT)")
+        cur.execute(f"ALTER TABLE users ADD COLUMN IF NOT EXISTS {ACCOUNT_KEY_COLUMN} bytea")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS users_{ACCOUNT_KEY_COLUMN}_idx ON users ({ACCOUNT_KEY_COLUMN})")
+        cur.execute(f"SELECT user_id, polkadot_address FROM users WHERE {ACCOUNT_KEY_COLUMN} IS NULL AND polkadot_address IS NOT NULL")
+        for user_id, address in cur.fetchall():
+            key = try_account_key(address)
+            if key:
+                cur.execute(f"UPDATE users SET {ACCOUNT_KEY_COLUMN} = %s WHERE user_id = %s", (key, user_id))
+    db.commit()
+
+
+def backfill_pool_keys(db):
+    """Add and fill account_key on the pools table, which is maintained outside the nightly import."""
+    with db.cursor() as cur:
+        cur.execute("SELECT to_regclass('pools')")
+        if cur.fetchone()[0] is None:
+            return False
+        cur.execute(f"ALTER TABLE pools ADD COLUMN IF NOT EXISTS {ACCOUNT_KEY_COLUMN} bytea")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS pools_{ACCOUNT_KEY_COLUMN}_idx ON pools ({ACCOUNT_KEY_COLUMN})")
+        # rows added since the last run have no key yet
+        cur.execute(f"SELECT DISTINCT address FROM pools WHERE {ACCOUNT_KEY_COLUMN} IS NULL AND address IS NOT NULL")
+        for (address,) in cur.fetchall():
+            key = try_account_key(address)
+            if key:
+                cur.execute(f"UPDATE pools SET {ACCOUNT_KEY_COLUMN} = %s WHERE address = %s AND {ACCOUNT_KEY_COLUMN} IS NULL", (key, address))
+    db.commit()
+    return True
+
+
+def get_recommendation(db, address):
+    """Pool recommendation of the nightly job for an address of any SS58 format, or None."""
+    account_key = try_account_key(address)
+    if account_key is None:
+        return None
+    with db.cursor() as cur:
+        cur.execute("SELECT to_regclass('recommendations')")
+        if cur.fetchone()[0] is None:
+            return None
+    with db.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT n.address, r.cluster, p.address AS pool_address, r.score, p."APY" AS "poolAPY", p."currentEraFee" AS "poolFee"
+            FROM recommendations r
+            LEFT JOIN dashboard n ON n.account_key = r.account_key
+            LEFT JOIN dashboard p ON p.account_key = r.pool_account_key
+            WHERE r.account_key = %s
+        """, (account_key,))
+        return cur.fetchone()
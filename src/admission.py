@@ -0,0 +1,105 @@
+import functools
+import threading
+import time
+
+import flask
+import psycopg2.errors
+import psycopg2.pool
+
+import metrics
+
+RETRY_AFTER_SECONDS = 2
+
+
+class RouteLimiter:
+    """Allows `concurrency` requests in flight and at most `queue` more waiting up to `wait` seconds for a slot."""
+
+    def __init__(self, name, concurrency, queue, wait):
+        self.name = name
+        self.queue = queue
+        self.wait = wait
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.waiting = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.slots.acquire(blocking=False):
+            return True
+        with self.lock:
+            if self.waiting >= self.queue:
+                return False
+            self.waiting += 1
+        start = time.perf_counter()
+        try:
+            return self.slots.acquire(timeout=self.wait)
+        finally:
+            metrics.ADMISSION_WAIT.labels(self.name).observe(time.perf_counter() - start)
+            with self.lock:
+                self.waiting -= 1
+
+    def release(self):
+        self.slots.release()
+
+
+def unavailable(message="Server is busy, please retry"):
+    response = flask.make_response(message, 503)
+    response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+    return response
+
+
+def limit(concurrency, queue, wait=0.5, statement_timeout=5000, stream_formats=(), stream_concurrency=1, stream_queue=0):
+    """Admission control for a route.
+
+    Requests beyond `concurrency` wait in a bounded queue and get a 503 with
+    Retry-After once it is full or their wait runs out. Connections checked out
+    while handling the request get `statement_timeout` (ms), enforced by the server.
+    Requests whose `format=` is one of `stream_formats` hold their slot for the
+    whole download, they get `stream_concurrency` slots of their own so they
+    can't crowd out the short requests.
+    """
+    def decorator(view):
+        limiter = RouteLimiter(view.__name__, concurrency, queue, wait)
+        stream_limiter = RouteLimiter(f"{view.__name__}.stream", stream_concurrency, stream_queue, wait)
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            slots = stream_limiter if flask.request.args.get('format') in stream_formats else limiter
+            if not slots.acquire():
+                metrics.ADMISSION_REJECTED.labels(slots.name, 'saturated').inc()
+                return unavailable()
+            flask.g.statement_timeout = statement_timeout
+            try:
+                response = flask.make_response(view(*args, **kwargs))
+            except BaseException:
+                slots.release()
+                raise
+            # streamed responses keep their slot until the last chunk is sent
+            response.call_on_close(slots.release)
+            return response
+        return wrapper
+    return decorator
+
+
+def arm(conn, statement_timeout):
+    """Apply statement_timeout (ms) to the transaction of a checked out connection.
+
+    SET LOCAL ends with the transaction, the pool rolls back connections handed
+    back mid-transaction so nothing leaks into the next checkout. Statements
+    after a commit in the same checkout run without the timeout.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SET LOCAL statement_timeout = %s", (statement_timeout,))
+
+
+def install(app):
+    """Turn pool exhaustion and cancelled queries into 503s instead of stack traces."""
+
+    @app.errorhandler(psycopg2.pool.PoolError)
+    def pool_exhausted(e):
+        metrics.ADMISSION_REJECTED.labels(flask.request.endpoint, 'pool_exhausted').inc()
+        return unavailable()
+
+    @app.errorhandler(psycopg2.errors.QueryCanceled)
+    def query_canceled(e):
+        metrics.ADMISSION_REJECTED.labels(flask.request.endpoint, 'statement_timeout').inc()
+        return unavailable("Query took too long, please retry or narrow down the request")
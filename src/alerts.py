@@ -0,0 +1,133 @@
+import logging
+import os
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows ~30 messages/second per bot, stay well below that
+SEND_INTERVAL_SECONDS = 0.05
+MAX_SEND_ATTEMPTS = 3
+
+ALERT_MESSAGES = {
+    'inactive': "🟥 Your address is no longer an active nominator.",
+    'below_minimum_stake': "🔒 Your stake fell below the minimum active stake of `{minimum_stake} DOT`.",
+    'max_fee_validator': "💸 A validator with a 100% fee is in your active set.",
+    'no_active_validators': "🔧 None of your validators are active anymore.",
+}
+
+# Compares the previous and the freshly imported dashboard for every registered
+# address in a single pass. Every event only fires on a transition, so users
+# whose status didn't change don't get notified again every night.
+ALERTS_QUERY = """
+WITH
+    minimum_stake AS (
+        SELECT CAST(data->>'minimumActiveStake' AS NUMERIC) / 1e10 AS value
+        FROM subscan
+        ORDER BY id DESC
+        LIMIT 1
+    ),
+    changes AS (
+        SELECT
+            u.user_id,
+            u.polkadot_address,
+            m.value AS minimum_stake,
+            COALESCE(p."activeNominator", '0') = '1' AS prev_active,
+            COALESCE(n."activeNominator", '0') = '1' AS new_active,
+            CAST(NULLIF(p."currentStake", '') AS NUMERIC) AS prev_stake,
+            CAST(NULLIF(n."currentStake", '') AS NUMERIC) AS new_stake,
+            COALESCE(CAST(NULLIF(p."validatorsMaxFeeInSet", '') AS NUMERIC), 0) AS prev_max_fee,
+            COALESCE(CAST(NULLIF(n."validatorsMaxFeeInSet", '') AS NUMERIC), 0) AS new_max_fee,
+            CAST(NULLIF(p."activeValidators", '') AS NUMERIC) AS prev_active_validators,
+            CAST(NULLIF(n."activeValidators", '') AS NUMERIC) AS new_active_validators
+        FROM users u
+        LEFT JOIN dashboard_previous p ON p.account_key = u.account_key
+        LEFT JOIN dashboard n ON n.account_key = u.account_key
+        LEFT JOIN minimum_stake m ON TRUE
+        WHERE u.account_key IS NOT NULL
+    )
+SELECT
+    c.user_id,
+    c.polkadot_address,
+    ROUND(c.minimum_stake, 2) AS minimum_stake,
+    ARRAY_AGG(e.event ORDER BY e.event) AS events
+FROM changes c
+CROSS JOIN LATERAL (VALUES
+    ('inactive', c.prev_active AND NOT c.new_active),
+    ('below_minimum_stake', c.new_stake < c.minimum_stake AND NOT COALESCE(c.prev_stake < c.minimum_stake, FALSE)),
+    ('max_fee_validator', c.new_max_fee > 0 AND c.prev_max_fee = 0),
+    ('no_active_validators', c.new_active_validators = 0 AND COALESCE(c.prev_active_validators, 0) > 0)
+) AS e(event, fired)
+WHERE e.fired
+GROUP BY c.user_id, c.polkadot_address, c.minimum_stake
+"""
+
+
+def rotate_dashboard(db):
+    """Keep the current dashboard around as the previous generation before it is re-imported."""
+    with db.cursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS dashboard_previous")
+        cur.execute("ALTER TABLE IF EXISTS dashboard RENAME TO dashboard_previous")
+    db.commit()
+
+
+def find_alerts(db):
+    """Return (user_id, address, minimum_stake, events) for every user whose status changed."""
+    with db.cursor() as cur:
+        cur.execute("SELECT to_regclass('dashboard_previous'), to_regclass('users'), to_regclass('subscan')")
+        if None in cur.fetchone():
+            return []
+        # generations imported before account keys existed can't be joined
+        cur.execute("SELECT 1 FROM information_schema.columns WHERE table_name = 'dashboard_previous' AND column_name = 'account_key'")
+        if cur.fetchone() is None:
+            return []
+        cur.execute(ALERTS_QUERY)
+        return cur.fetchall()
+
+
+def format_alert(address, minimum_stake, events):
+    message = f"🔔 **Staking update for** `{address}`\n"
+    for event in events:
+        message += f"\n- {ALERT_MESSAGES[event].format(minimum_stake=minimum_stake)}"
+    return message
+
+
+def send_alert(bot, chat_id, message):
+    import telegram
+    for attempt in range(MAX_SEND_ATTEMPTS):
+        try:
+            bot.send_message(chat_id=chat_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
+            return True
+        except telegram.error.RetryAfter as e:
+            metrics.TELEGRAM_THROTTLED.labels('send_message').inc()
+            time.sleep(e.retry_after)
+        except telegram.error.Unauthorized:
+            # user blocked the bot
+            return False
+        except Exception as e:
+            logger.error(f"Failed to send alert to {chat_id}: {e}")
+            return False
+    return False
+
+
+def send_alerts(alerts, bot=None):
+    """Fan out alerts through a single rate-limited sender, returns the number of delivered messages."""
+    if not alerts:
+        return 0
+    if bot is None:
+        import telegram
+        bot = telegram.Bot(os.environ['TELEGRAM_BOT_TOKEN'])
+    sent = 0
+    for user_id, address, minimum_stake, events in alerts:
+        if send_alert(bot, user_id, format_alert(address, minimum_stake, events)):
+            sent += 1
+        time.sleep(SEND_INTERVAL_SECONDS)
+    return sent
+
+
+def run_alerts(db):
+    """Alerts of the fresh import, hand the connection back before passing them to send_alerts."""
+    alerts = find_alerts(db)
+    db.commit()
+    return alerts
@@ -1,36 +1,72 @@
-from substrateinterface import SubstrateInterface
+import startup
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import flask
-import psycopg2, psycopg2.pool
-from psycopg2.extras import RealDictCursor
-import requests
 import os, glob, sys, traceback
-import bs4
-import schedule
-from jinja2 import Template
 import time
 import threading
 import re
 import json
-from google.cloud import storage
-import pandas as pd 
 import gzip
+import zlib
+import io
+import itertools
+import csv
 import shutil
-from tqdm import tqdm
 import subprocess
 
-from bot import main as bot_main
+# heavy dependencies (pandas, numpy, substrate-interface, telegram, openai,
+# google-cloud-storage) are imported on first use so every role only pays for what it runs
+with startup.timed('flask, psycopg2, requests'):
+    import flask
+    from psycopg2.extras import RealDictCursor
+    import requests
+    import schedule
+
+with startup.timed('app modules'):
+    import alerts
+    import metrics
+    import admission
+    import accounts
+    import history
+    import jobs
+    import database
+    from blob_source import get_blob_source
+
+# routes are registered on a blueprint, the flask app is only built by the api role
+api = flask.Blueprint('api', __name__)
+
+
+def create_app():
+    app = flask.Flask(__name__)
+    metrics.install(app)
+    admission.install(app)
+    app.register_blueprint(api)
+    return app
 
-app = flask.Flask(__name__)
-pool = psycopg2.pool.SimpleConnectionPool(1, 20, f"dbname={os.environ['POSTGRES_DB']} user={os.environ['POSTGRES_USER']} password={os.environ['POSTGRES_PASSWORD']} host={os.environ['POSTGRES_HOST']}")
 
 class ConnectionFromPool:
+    def __init__(self, statement_timeout=None, readonly=False, name='api'):
+        # routes behind admission.limit get their statement timeout from the request
+        if statement_timeout is None and flask.has_request_context():
+            statement_timeout = flask.g.get('statement_timeout')
+        self.statement_timeout = statement_timeout
+        # read-only work goes to a replica when one is healthy and up to date, writes to the primary
+        self.readonly = readonly
+        self.name = name
+
     def __enter__(self):
-        self.conn = pool.getconn()
+        self.router = database.get_router()
+        self.pool, self.conn = self.router.getconn(readonly=self.readonly, name=self.name)
+        if self.statement_timeout:
+            try:
+                admission.arm(self.conn, self.statement_timeout)
+            except Exception:
+                self.router.putconn(self.pool, self.conn)
+                raise
         return self.conn
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        pool.putconn(self.conn)
+        # the pool rolls back an open transaction, which also ends a SET LOCAL timeout
+        self.router.putconn(self.pool, self.conn)
 
 data_types_map = {
         "INTEGER": "bigint",
@@ -49,7 +85,6 @@ POLKADOT_STAKE_CONSTANTS = {
     'stakeTarget': 0.75
 }
 
-BUCKET_NAME = 'export-bucket'
 DOWNLOAD_PATH = '/tmp/gcs_downloads'
 PROCESSED_DATA_PATH = '/tmp/processed_data'
 
@@ -89,15 +124,15 @@ def calc_inflation(total_staked: float, total_issuance: float, num_auctions: int
 
 
 def notify(message):
-    response = requests.get(os.environ['TELEGRAM_URI'] + "&text=" + message)
-    response.raise_for_status()
+    # local and benchmark runs have no telegram channel configured
+    if 'TELEGRAM_URI' in os.environ:
+        response = requests.get(os.environ['TELEGRAM_URI'] + "&text=" + message)
+        response.raise_for_status()
     print(f"{message}", flush=True)
 
 
 def get_table_names():
-    client = storage.Client()
-    bucket = client.bucket(BUCKET_NAME)
-    blobs = bucket.list_blobs(prefix='export/')
+    blobs = get_blob_source().list_blobs(prefix='export/')
     
     table_names = set()
     for blob in blobs:
@@ -112,40 +147,46 @@ def get_table_names():
 def download_and_import_blob(blob, table_name, is_create_table=False):
     local_path = os.path.join(DOWNLOAD_PATH, os.path.basename(blob.name))
     line_count = 0
+    start = time.perf_counter()
 
     with open(local_path, 'wb') as file_obj:
         blob.download_to_file(file_obj)
     
     processed_path = os.path.join(PROCESSED_DATA_PATH, os.path.basename(blob.name)).replace('.csv.gz', '.csv')
     with gzip.open(local_path, 'rt') as gz_file:
-        with open(processed_path, 'w') as file_obj:
-            file_obj.write(gz_file.read())
+        with open(processed_path, 'w', newline='') as file_obj:
+            if table_name in accounts.ACCOUNT_KEY_TABLES:
+                accounts.add_account_keys(gz_file, file_obj, accounts.ACCOUNT_KEY_TABLES[table_name])
+            else:
+                file_obj.write(gz_file.read())
+            file_obj.flush()
             line_count = int(os.popen(f"cat {processed_path} | wc -l").read().strip())
         if is_create_table:
+            import pandas as pd
             df = pd.read_csv(processed_path, nrows=1)
             create_table(df, table_name)
 
-    db = pool.getconn()
-    cur = db.cursor()
-    with open(processed_path, 'r') as file:
-        cur.copy_expert(f"COPY {table_name} FROM STDIN CSV HEADER", file)
-    db.commit()
-    cur.close()
-    pool.putconn(db)    
+    with ConnectionFromPool(name='ingest') as db:
+        cur = db.cursor()
+        with open(processed_path, 'r') as file:
+            cur.copy_expert(f"COPY {table_name} FROM STDIN CSV HEADER", file)
+        db.commit()
+        cur.close()
     
+    shard = os.path.basename(blob.name).split('.')[1]
+    metrics.observe_ingest(table_name, shard, line_count, os.path.getsize(local_path), time.perf_counter() - start)
+
     os.remove(local_path)
     os.remove(processed_path)
     return line_count
 
 def get_table(table_name):
-    client = storage.Client()
-    bucket = client.bucket(BUCKET_NAME)
-    blobs = list(bucket.list_blobs(prefix=f'export/{table_name}'))
+    blobs = list(get_blob_source().list_blobs(prefix=f'export/{table_name}'))
     line_count = 0
 
     try:
         first_blob = blobs[0]
-        download_and_import_blob(first_blob, table_name, is_create_table=True)
+        line_count += download_and_import_blob(first_blob, table_name, is_create_table=True)
         with ThreadPoolExecutor(max_workers=8) as executor:
             futures = [executor.submit(download_and_import_blob, blob, table_name) for blob in blobs[1:]]
             for future in as_completed(futures):
@@ -155,95 +196,200 @@ def get_table(table_name):
             del futures
             del blobs
         notify(f"Finished updating Lambda table {table_name}")
+        return line_count
     except (StopIteration, IndexError):
         print(f"No blobs found for table {table_name}")
     except Exception as e:
         notify(f"Error occurred while getting table {table_name}: {e}")
         traceback.print_exc()
+    return None
 
 def create_table(df, table_name):
-    db = pool.getconn()
-    cur = db.cursor()
     create_table_query = f"CREATE TABLE IF NOT EXISTS {table_name} ("
     for column in df.columns:
         data_type = data_types_map.get(str(df[column].dtype).upper(), 'text')
+        if column == accounts.ACCOUNT_KEY_COLUMN:
+            data_type = 'bytea'
         # Enclose the column name in double quotes to maintain capitalisation
         create_table_query += f"\"{column}\" {data_type}, "
     create_table_query = create_table_query[:-2] + ")"
-    cur.execute(create_table_query)
-    db.commit()
-    cur.close()
-    pool.putconn(db)
+    with ConnectionFromPool(name='ingest') as db:
+        cur = db.cursor()
+        cur.execute(create_table_query)
+        db.commit()
+        cur.close()
 
 
 def runDailyQueries():
     #glob .sql_daily files
-    db = pool.getconn()
-    cur = db.cursor()
-    for path in sorted(glob.glob("daily_queries/*.sql")):
-        with open(path, 'r') as file:
-            timestamp = int(time.time())
-            query = file.read()
-            cur.execute(query)
-            db.commit()
-            print(f"Executed {path} in {int(time.time()) - timestamp} seconds", flush=True)
-    cur.close()
+    with ConnectionFromPool() as db:
+        cur = db.cursor()
+        for path in sorted(glob.glob("daily_queries/*.sql")):
+            with open(path, 'r') as file:
+                timestamp = int(time.time())
+                query = file.read()
+                cur.execute(query)
+                db.commit()
+                print(f"Executed {path} in {int(time.time()) - timestamp} seconds", flush=True)
+        cur.close()
     notify("Finished running daily queries")
 
-@app.route("/table")
+STREAM_BATCH_SIZE = 5000
+# a sorted download has to sort the whole table before its first FETCH returns
+STREAM_STATEMENT_TIMEOUT = 120000
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def stream_rows(query, output_format, compress, statement_timeout=STREAM_STATEMENT_TIMEOUT):
+    """Yield the result of query in batches from a server-side cursor, optionally gzipped.
+
+    The first chunk is yielded once the query ran and its first batch was fetched,
+    pull it before sending the response so errors still get a status code.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def encode(chunk):
+        if compressor is None:
+            return chunk.encode('utf-8')
+        return compressor.compress(chunk.encode('utf-8'))
+
+    # every FETCH is bounded by the statement timeout, the download as a whole is not
+    with ConnectionFromPool(statement_timeout=statement_timeout, readonly=True) as db:
+        # named cursors only fetch itersize rows at a time instead of the whole result
+        with db.cursor(name='table_stream', cursor_factory=RealDictCursor) as cur:
+            cur.itersize = STREAM_BATCH_SIZE
+            with metrics.timed(metrics.QUERY_LATENCY, 'table.stream'):
+                cur.execute(query)
+                rows = cur.fetchmany(STREAM_BATCH_SIZE)
+
+            columns = [column.name for column in cur.description if column.name != accounts.ACCOUNT_KEY_COLUMN]
+            buffer = io.StringIO()
+            if output_format == 'csv':
+                # the header is written even when nothing matched
+                writer = csv.DictWriter(buffer, columns)
+                writer.writeheader()
+            yield encode(buffer.getvalue())
+
+            while rows:
+                accounts.strip_account_keys(rows)
+                buffer = io.StringIO()
+                if output_format == 'csv':
+                    csv.DictWriter(buffer, columns).writerows(rows)
+                else:
+                    for row in rows:
+                        buffer.write(json.dumps(row, default=str))
+                        buffer.write("\n")
+                data = encode(buffer.getvalue())
+                if data:
+                    yield data
+                rows = cur.fetchmany(STREAM_BATCH_SIZE)
+        db.rollback()
+
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def dashboard_columns():
+    with ConnectionFromPool(readonly=True) as db:
+        with db.cursor() as cur:
+            cur.execute("SELECT attname FROM pg_attribute WHERE attrelid = to_regclass('dashboard') AND attnum > 0 AND NOT attisdropped")
+            return [row[0] for row in cur.fetchall()]
+
+
+@api.route("/table")
+@admission.limit(concurrency=10, queue=20, statement_timeout=5000, stream_formats=STREAM_FORMATS, stream_concurrency=3, stream_queue=3)
 def table():
     # get request parameters
     params = flask.request.args
-    with ConnectionFromPool() as db:
-        with db.cursor(cursor_factory=RealDictCursor) as cur:
 
-            # base query string
-            query = 'SELECT * FROM "dashboard" WHERE 1=1'
-
-            # validation checks and query modifications based on input parameters
-            if "search" in params and not re.match("^[a-zA-Z0-9_]*$", params['search']):
-                return "Search parameter must be alphanumeric"
-            elif "search" in params:
-                query += f' AND "dashboard"."address" LIKE \'%{params["search"]}%\''
-
-            #match numbers, dots and commas
-            if "minStake" in params and not re.match("^[0-9.,]*$", params['minStake']):
-                return "minStake parameter must be numeric"
-            elif "minStake" in params:
-                query += f' AND CAST("dashboard"."currentStake" AS NUMERIC) >= {params["minStake"]}'
-
-            if "maxStake" in params and not re.match("^[0-9.,]*$", params['maxStake']):
-                return "maxStake parameters must be numeric"
-            elif "maxStake" in params:
-                query += f' AND CAST("dashboard"."currentStake" AS NUMERIC) <= {params["maxStake"]}'
-
-            if "activeOnly" in params and int(params["activeOnly"]) == 1: 
-                query += f' AND CAST("dashboard"."activeNominator" AS NUMERIC) = 1'
-
-            if "sortColumn" in params and not re.match("^[a-zA-Z0-9_]*$", params['sortColumn']):
-                return "Sort column must be alphanumeric"
-            elif "sortColumn" in params:
-                query += f' ORDER BY CAST("dashboard"."{params["sortColumn"]}" AS NUMERIC) {"ASC" if params["sortUp"] == "1" else "DESC"}'
-
-            if "size" in params and not re.match("^[0-9]*$", params['size']):
-                return "Size parameter must be numeric"
-            elif "size" in params and "offset" in params and not re.match("^[0-9]*$", params['offset']):
-                return "Offset parameter must be numeric"
-            elif "size" in params and "offset" in params:
-                query += f' LIMIT {params["size"]} OFFSET {params["offset"]}'
-
-            # perform query
-            cur.execute(query)
-            rows = cur.fetchall()
+    # column projection
+    columns = '*'
+    if "fields" in params and not re.match("^[a-zA-Z0-9_,]+$", params['fields']):
+        return "Fields must be a comma separated list of alphanumeric column names"
+    elif "fields" in params:
+        fields = [field for field in params['fields'].split(',') if field and field != accounts.ACCOUNT_KEY_COLUMN]
+        unknown = set(fields) - set(dashboard_columns())
+        if unknown:
+            return f"Unknown fields: {', '.join(sorted(unknown))}"
+        columns = ", ".join(f'"dashboard"."{field}"' for field in fields) or '*'
+
+    output_format = params.get('format', 'json')
+    if output_format != 'json' and output_format not in STREAM_FORMATS:
+        return f"Format must be one of json, {', '.join(STREAM_FORMATS)}"
+
+    # base query string
+    query = f'SELECT {columns} FROM "dashboard" WHERE 1=1'
+
+    # validation checks and query modifications based on input parameters
+    if "search" in params and not re.match("^[a-zA-Z0-9_]*$", params['search']):
+        return "Search parameter must be alphanumeric"
+    elif "search" in params:
+        query += f' AND "dashboard"."address" LIKE \'%{params["search"]}%\''
+
+    #match numbers, dots and commas
+    if "minStake" in params and not re.match("^[0-9.,]*$", params['minStake']):
+        return "minStake parameter must be numeric"
+    elif "minStake" in params:
+        query += f' AND CAST("dashboard"."currentStake" AS NUMERIC) >= {params["minStake"]}'
+
+    if "maxStake" in params and not re.match("^[0-9.,]*$", params['maxStake']):
+        return "maxStake parameters must be numeric"
+    elif "maxStake" in params:
+        query += f' AND CAST("dashboard"."currentStake" AS NUMERIC) <= {params["maxStake"]}'
+
+    if "activeOnly" in params and int(params["activeOnly"]) == 1: 
+        query += f' AND CAST("dashboard"."activeNominator" AS NUMERIC) = 1'
+
+    if "sortColumn" in params and not re.match("^[a-zA-Z0-9_]*$", params['sortColumn']):
+        return "Sort column must be alphanumeric"
+    elif "sortColumn" in params:
+        query += f' ORDER BY CAST("dashboard"."{params["sortColumn"]}" AS NUMERIC) {"ASC" if params["sortUp"] == "1" else "DESC"}'
+
+    if "size" in params and not re.match("^[0-9]*$", params['size']):
+        return "Size parameter must be numeric"
+    elif "size" in params and "offset" in params and not re.match("^[0-9]*$", params['offset']):
+        return "Offset parameter must be numeric"
+    elif "size" in params and "offset" in params:
+        query += f' LIMIT {params["size"]} OFFSET {params["offset"]}'
 
+    with ConnectionFromPool() as db:
+        with db.cursor() as cur:
             cur.execute("CREATE TABLE IF NOT EXISTS search_log (id SERIAL PRIMARY KEY, search_params JSONB, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
-            cur.execute("INSERT INTO search_log (search_params) VALUES (%s)", (json.dumps(params),))
-            db.commit()
+            with metrics.timed(metrics.QUERY_LATENCY, 'search_log'):
+                cur.execute("INSERT INTO search_log (search_params) VALUES (%s)", (json.dumps(params),))
+                db.commit()
+
+    if output_format in STREAM_FORMATS:
+        compress = 'gzip' in flask.request.headers.get('Accept-Encoding', '')
+        chunks = stream_rows(query, output_format, compress)
+        # runs the query and fetches the first batch, a failure here still gets a proper status
+        first = next(chunks)
+        response = flask.Response(itertools.chain([first], chunks), mimetype=STREAM_FORMATS[output_format])
+        # hands the connection back when the client goes away mid-download
+        response.call_on_close(chunks.close)
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+            response.headers['Vary'] = 'Accept-Encoding'
+        if output_format == 'csv':
+            response.headers['Content-Disposition'] = 'attachment; filename=dashboard.csv'
+        return response
+
+    with ConnectionFromPool(readonly=True) as db:
+        with db.cursor(cursor_factory=RealDictCursor) as cur:
+            # perform query
+            with metrics.timed(metrics.QUERY_LATENCY, 'table'):
+                cur.execute(query)
+                rows = accounts.strip_account_keys(cur.fetchall())
 
-    return flask.jsonify(rows)
+    with metrics.timed(metrics.SERIALIZE_LATENCY, '/table'):
+        return flask.jsonify(rows)
 
 
-@app.route("/submit_email", methods=["POST"])
+@api.route("/submit_email", methods=["POST"])
+@admission.limit(concurrency=2, queue=4, statement_timeout=1000)
 def submit_email():
     email = flask.request.json['email']
 
@@ -257,16 +403,19 @@ def submit_email():
             db.commit()
     return "OK"
 
-@app.route("/grey")
+@api.route("/grey")
+@admission.limit(concurrency=4, queue=8, statement_timeout=1000)
 def grey():
     #return latest subscan data
-    with ConnectionFromPool() as db:
+    with ConnectionFromPool(readonly=True) as db:
         with db.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM subscan ORDER BY id DESC LIMIT 1")
-            row = cur.fetchone()
+            with metrics.timed(metrics.QUERY_LATENCY, 'grey'):
+                cur.execute("SELECT * FROM subscan ORDER BY id DESC LIMIT 1")
+                row = cur.fetchone()
     return flask.jsonify(row)
 
-@app.route("/blue")
+@api.route("/blue")
+@admission.limit(concurrency=4, queue=8, statement_timeout=5000)
 def blue():
     nominators = """
     WITH
@@ -313,7 +462,7 @@ def blue():
     FROM
       "dashboard" as d
     INNER JOIN
-      "pools" as p ON p."address" = d."address"
+      "pools" as p ON p."account_key" = d."account_key"
     WHERE
       d."APY" IS NOT NULL
     ORDER BY
@@ -321,17 +470,60 @@ def blue():
     LIMIT 1;
     """
     result = {}
-    with ConnectionFromPool() as db:
+    with ConnectionFromPool(readonly=True) as db:
         with db.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(nominators)
-            rows = cur.fetchall()
+            with metrics.timed(metrics.QUERY_LATENCY, 'blue.nominators'):
+                cur.execute(nominators)
+                rows = cur.fetchall()
             result['nominators'] = rows
 
-            cur.execute(pools)
-            rows = cur.fetchall()
+            with metrics.timed(metrics.QUERY_LATENCY, 'blue.pools'):
+                cur.execute(pools)
+                rows = cur.fetchall()
             result['pools'] = rows
 
-    return flask.jsonify(result)
+    with metrics.timed(metrics.SERIALIZE_LATENCY, '/blue'):
+        return flask.jsonify(result)
+
+@api.route("/history")
+@admission.limit(concurrency=4, queue=8, statement_timeout=2000)
+def address_history():
+    params = flask.request.args
+    if "address" not in params:
+        return "Address parameter is required"
+    account_key = accounts.try_account_key(params['address'])
+    if account_key is None:
+        return "Address must be a valid SS58 address"
+    if "days" in params and not re.match("^[0-9]+$", params['days']):
+        return "Days parameter must be numeric"
+
+    with ConnectionFromPool(readonly=True) as db:
+        with db.cursor() as cur:
+            cur.execute("SELECT to_regclass('dashboard_history')")
+            if cur.fetchone()[0] is None:
+                return flask.jsonify([])
+            with metrics.timed(metrics.QUERY_LATENCY, 'history'):
+                rows = history.address_history(cur, account_key, int(params['days']) if "days" in params else None)
+    return flask.jsonify(rows)
+
+@api.route("/recommendation")
+@admission.limit(concurrency=4, queue=8, statement_timeout=1000)
+def recommendation():
+    params = flask.request.args
+    if "address" not in params:
+        return "Address parameter is required"
+    if accounts.try_account_key(params['address']) is None:
+        return "Address must be a valid SS58 address"
+    with ConnectionFromPool(readonly=True) as db:
+        with metrics.timed(metrics.QUERY_LATENCY, 'recommendation'):
+            row = accounts.get_recommendation(db, params['address'])
+    if row is None:
+        return "No recommendation for this address yet", 404
+    return flask.jsonify(row)
+
+# the job runner only reports overruns, a hung export would keep the lambda lock forever
+EXPORT_TIMEOUT_SECONDS = 2 * 3600
+
 
 def run_export_script():
     try:
@@ -339,11 +531,36 @@ def run_export_script():
             ["bash", "export.sh"],
             check=True,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+            stderr=subprocess.PIPE,
+            timeout=EXPORT_TIMEOUT_SECONDS
         )
         print(response.stdout.decode('utf-8'))
     except subprocess.CalledProcessError as e:
         notify(f"Error occurred while running export.sh: {e.stderr.decode('utf-8')}")
+    except subprocess.TimeoutExpired:
+        notify(f"export.sh didn't finish within {EXPORT_TIMEOUT_SECONDS} seconds")
+        raise
+
+
+def import_table(table_name):
+    with ConnectionFromPool() as db:
+        if table_name == 'dashboard':
+            # keep yesterday's generation for the alert diff
+            alerts.rotate_dashboard(db)
+        else:
+            with db.cursor() as cur:
+                cur.execute(f"DROP TABLE IF EXISTS {table_name}")
+            db.commit()
+
+    line_count = get_table(table_name)
+    if line_count is None:
+        return None
+    with ConnectionFromPool() as db:
+        if table_name in accounts.ACCOUNT_KEY_TABLES:
+            accounts.index_account_keys(db, table_name)
+        # reads fall back to the primary until the replicas have replayed this load
+        database.bump_generation(db, table_name)
+    return line_count
 
 
 def updateLambdaTask():
@@ -360,19 +577,78 @@ def updateLambdaTask():
     table_names = get_table_names()
     notify(f"Found {len(table_names)} tables in Google Cloud Storage")
     
+    dashboard_updated = False
+    total_rows = 0
+    failed = []
     for table_name in table_names:
-        with ConnectionFromPool() as db:
-            with db.cursor() as cur:
-                cur.execute(f"DROP TABLE IF EXISTS {table_name}")
-            db.commit()
-
-        get_table(table_name)
+        line_count = import_table(table_name)
+        if line_count is None:
+            failed.append(table_name)
+            continue
+        total_rows += line_count
+        if table_name == 'dashboard':
+            dashboard_updated = True
 
     notify("Finished updating Lambda tables")
+    backfillPoolKeys()
+    if dashboard_updated:
+        recordHistory()
+        runRecommendations()
+        runAlerts()
     #runDailyQueries()
+    if failed:
+        # get_table already notified about each table, this marks the run as failed in job_runs
+        raise RuntimeError(f"Failed to import {len(failed)} of {len(table_names)} tables: {', '.join(failed)}")
+    return total_rows
     
 
+def backfillPoolKeys():
+    # pools is maintained outside the export, key the rows added since the last run
+    try:
+        with ConnectionFromPool() as db:
+            accounts.backfill_pool_keys(db)
+    except Exception as e:
+        notify(f"Error occurred while keying the pools table: {e}")
+        traceback.print_exc()
+
+
+def recordHistory():
+    try:
+        with ConnectionFromPool() as db:
+            rows = history.append_snapshot(db)
+            history.apply_retention(db)
+        notify(f"Recorded {rows} changed rows in dashboard history")
+    except Exception as e:
+        notify(f"Error occurred while recording dashboard history: {e}")
+        traceback.print_exc()
+
+
+def runRecommendations():
+    try:
+        import recommendations
+        with ConnectionFromPool() as db:
+            rows, seconds = recommendations.run_recommendations(db)
+        notify(f"Generated pool recommendations for {rows} nominators in {int(seconds)} seconds")
+    except Exception as e:
+        notify(f"Error occurred while generating recommendations: {e}")
+        traceback.print_exc()
+
+
+def runAlerts():
+    try:
+        with ConnectionFromPool() as db:
+            accounts.backfill_user_keys(db)
+            pending = alerts.run_alerts(db)
+        # the rate-limited fan-out takes minutes, it must not hold a pool connection
+        sent = alerts.send_alerts(pending)
+        notify(f"Sent {sent} of {len(pending)} nominator alerts")
+    except Exception as e:
+        notify(f"Error occurred while sending alerts: {e}")
+        traceback.print_exc()
+
+
 def updateSubscanTask():
+    from substrateinterface import SubstrateInterface
     try:
         #while substrate interface isn't ok, keep trying different RPC nodes
         nodes = [
@@ -385,9 +661,11 @@ def updateSubscanTask():
 
         for node in nodes:
             try:
-                substrate = SubstrateInterface(url=node)
+                with metrics.timed(metrics.RPC_LATENCY, node, 'connect'):
+                    substrate = SubstrateInterface(url=node)
                 break
             except Exception as e:
+                metrics.RPC_ERRORS.labels(node).inc()
                 print(f"Failed to connect to {node}: {e}", flush=True)
                 continue
 
@@ -395,30 +673,36 @@ def updateSubscanTask():
             notify("Failed to connect to any RPC node")
             return
 
+        def query(module, storage_function, params):
+            with metrics.timed(metrics.RPC_LATENCY, substrate.url, f"{module}.{storage_function}"):
+                return substrate.query(module, storage_function, params)
+
         result = {}
-        result["era"] = substrate.query("Staking", "CurrentEra", []).value
-        result["totalValidatorCount"] = substrate.query("Staking", "CounterForValidators", []).value
-        result["currentValidatorCount"] = len(substrate.query("Session", "Validators", []))
-        result["totalIssuance"] = int(substrate.query("Balances", "TotalIssuance", []).value)
-        result["totalStaked"] = int(substrate.query("Staking", "ErasTotalStake", [result["era"]]).value)
-        result["numAuctions"] = int(substrate.query("Auctions", "AuctionCounter", []).value)
+        result["era"] = query("Staking", "CurrentEra", []).value
+        result["totalValidatorCount"] = query("Staking", "CounterForValidators", []).value
+        result["currentValidatorCount"] = len(query("Session", "Validators", []))
+        result["totalIssuance"] = int(query("Balances", "TotalIssuance", []).value)
+        result["totalStaked"] = int(query("Staking", "ErasTotalStake", [result["era"]]).value)
+        result["numAuctions"] = int(query("Auctions", "AuctionCounter", []).value)
         result["inflation"] = str(calc_inflation(result["totalStaked"], result["totalIssuance"], result["numAuctions"])['inflation'])
-        result["minimumActiveStake"] = int(substrate.query("Staking", "MinimumActiveStake", []).value)
+        result["minimumActiveStake"] = int(query("Staking", "MinimumActiveStake", []).value)
         result["percentageStaked"] = str(result["totalStaked"] / result["totalIssuance"])
 
         response = requests.get('https://api.coingecko.com/api/v3/simple/price?ids=polkadot&vs_currencies=usd')
         result["dotPrice"] = response.json()['polkadot']['usd']
         
-        db = pool.getconn()
-        cur = db.cursor()
-        cur.execute("CREATE TABLE IF NOT EXISTS subscan (id SERIAL PRIMARY KEY, era_id INTEGER, timestamp INTEGER, data JSONB)")
-        cur.execute("INSERT INTO subscan (era_id, timestamp, data) VALUES (%s, %s, %s)", (result["era"], int(time.time()), json.dumps(result)))
-        db.commit()
-        cur.close()
-        pool.putconn(db)
+        with ConnectionFromPool() as db:
+            cur = db.cursor()
+            cur.execute("CREATE TABLE IF NOT EXISTS subscan (id SERIAL PRIMARY KEY, era_id INTEGER, timestamp INTEGER, data JSONB)")
+            cur.execute("INSERT INTO subscan (era_id, timestamp, data) VALUES (%s, %s, %s)", (result["era"], int(time.time()), json.dumps(result)))
+            db.commit()
+            cur.close()
+        return 1
     except Exception as e:
         notify(f"Error occurred while updating Subscan table: {e}")
         traceback.print_exc() 
+        # let the job runner record the failed run
+        raise
 
 
 def scheduleThread():
@@ -426,9 +710,42 @@ def scheduleThread():
         schedule.run_pending()
         time.sleep(1)
 
+def create_runner():
+    runner = jobs.JobRunner(database.PRIMARY_DSN, notify=notify)
+    # the nightly import runs for hours, it must never overlap itself or starve the hourly snapshot
+    runner.add('lambda', updateLambdaTask, max_runtime=8 * 3600, overlap=jobs.SKIP)
+    runner.add('subscan', updateSubscanTask, max_runtime=15 * 60, overlap=jobs.QUEUE)
+    return runner
+
+ROLES = ('api', 'scheduler', 'bot')
+
 if __name__ == "__main__":
-    schedule.every().day.at("00:00").do(updateLambdaTask) 
-    schedule.every().hour.do(updateSubscanTask)
-    threading.Thread(target=scheduleThread).start()
-    threading.Thread(target=bot_main).start()
-    app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False)
+    # e.g. `python app.py api` or ROLES=scheduler,bot, every role runs by default
+    roles = set(",".join(sys.argv[1:]).split(",") if sys.argv[1:] else os.environ.get('ROLES', ",".join(ROLES)).split(","))
+    roles.discard('')
+    unknown = roles - set(ROLES)
+    if unknown:
+        sys.exit(f"Unknown roles: {', '.join(sorted(unknown))}, expected some of {', '.join(ROLES)}")
+
+    if 'scheduler' in roles:
+        runner = create_runner()
+        schedule.every().day.at("00:00").do(runner.trigger, 'lambda')
+        schedule.every().hour.do(runner.trigger, 'subscan')
+        threading.Thread(target=scheduleThread).start()
+    if 'bot' in roles:
+        with startup.timed('bot'):
+            import bot
+        threading.Thread(target=bot.main).start()
+    if 'api' in roles:
+        with startup.timed('api'):
+            app = create_app()
+            # open the pool before serving instead of on the first request
+            database.get_router()
+        # /blue joins pools on its key, don't wait for the nightly run after a deploy
+        threading.Thread(target=backfillPoolKeys, daemon=True).start()
+        startup.report()
+        app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False)
+    else:
+        # the scheduler and bot metrics would otherwise never be scraped
+        metrics.serve()
+        startup.report()
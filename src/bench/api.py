@@ -0,0 +1,97 @@
+"""Load test the API endpoints and the bot's fetch_relevant_data.
+
+    python -m bench.api --url http://localhost:5000 --concurrency 16 --requests 500 [--bot] [--json results.json]
+
+Run against an API started on top of data generated with `bench.synthetic --load`.
+"""
+import argparse
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+import requests
+
+from bench.stats import summarize
+
+SCENARIOS = {
+    '/table?size=50&offset=0&sortColumn=APY&sortUp=0': "leaderboard page",
+    '/table?size=50&offset=100000&sortColumn=currentStake&sortUp=0': "deep offset page",
+    '/table?minStake=1000&maxStake=5000&activeOnly=1&size=50&offset=0': "stake filter",
+    '/table?search=1abc&size=50&offset=0': "address search",
+    '/blue': "blue",
+    '/grey': "grey",
+}
+
+
+def sample_addresses(count):
+    db = psycopg2.connect(f"dbname={os.environ['POSTGRES_DB']} user={os.environ['POSTGRES_USER']} password={os.environ['POSTGRES_PASSWORD']} host={os.environ['POSTGRES_HOST']}")
+    with db.cursor() as cur:
+        cur.execute("SELECT address FROM dashboard TABLESAMPLE SYSTEM (1) LIMIT %s", (count,))
+        addresses = [row[0] for row in cur.fetchall()]
+    db.close()
+    return addresses
+
+
+def run(name, call, args, concurrency):
+    """Run call(arg) for every arg on `concurrency` workers and summarize the latencies."""
+    def timed(arg):
+        start = time.perf_counter()
+        try:
+            call(arg)
+            return time.perf_counter() - start, False
+        except Exception:
+            return time.perf_counter() - start, True
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, args))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency, failed in results if not failed]
+    return summarize(name, latencies, elapsed, errors=sum(failed for _, failed in results))
+
+
+def bench_http(url, concurrency, count):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    def get(path):
+        response = session.get(url + path)
+        response.raise_for_status()
+        return response.content
+
+    return [run(f"{name} ({path.split('?')[0]})", get, [path] * count, concurrency) for path, name in SCENARIOS.items()]
+
+
+def bench_bot(concurrency, count):
+    from bot import fetch_relevant_data
+
+    addresses = sample_addresses(count) or ['1' * 48]
+    args = [random.choice(addresses) for _ in range(count)]
+    return [run("fetch_relevant_data", fetch_relevant_data, args, concurrency)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=500, help="requests per scenario")
+    parser.add_argument('--bot', action='store_true', help="also benchmark fetch_relevant_data in-process")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args()
+
+    results = bench_http(args.url.rstrip('/'), args.concurrency, args.requests)
+    if args.bot:
+        results += bench_bot(args.concurrency, args.requests)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
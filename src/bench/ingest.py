@@ -0,0 +1,54 @@
+"""Benchmark the nightly import from a local blob source.
+
+    python -m bench.ingest --source /tmp/bench_export [--table dashboard] [--json results.json]
+
+Runs app.get_table against sharded .csv.gz files written by `bench.synthetic --out`
+and reports rows/sec and the peak RSS of the process.
+"""
+import argparse
+import json
+import os
+
+from bench.stats import Timer, peak_rss_mb
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', required=True, help="directory containing export/*.csv.gz")
+    parser.add_argument('--table', action='append', help="tables to import, defaults to all exported tables")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args()
+
+    os.environ['BLOB_SOURCE'] = args.source
+    import app
+
+    for path in (app.DOWNLOAD_PATH, app.PROCESSED_DATA_PATH):
+        os.makedirs(path, exist_ok=True)
+
+    results = []
+    for table_name in args.table or sorted(app.get_table_names()):
+        with Timer() as timer:
+            app.import_table(table_name)
+
+        with app.ConnectionFromPool() as db:
+            with db.cursor() as cur:
+                cur.execute(f"SELECT COUNT(*) FROM {table_name}")
+                rows = cur.fetchone()[0]
+
+        result = {
+            'table': table_name,
+            'rows': rows,
+            'seconds': timer.elapsed,
+            'rows_per_second': rows / timer.elapsed if timer.elapsed > 0 else 0.0,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        print(f"{table_name:<20} {rows} rows in {timer.elapsed:.1f}s, {result['rows_per_second']:.0f} rows/s, peak RSS {result['peak_rss_mb']:.0f} MB", flush=True)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
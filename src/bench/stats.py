@@ -0,0 +1,34 @@
+import resource
+import time
+
+import numpy as np
+
+
+def summarize(name, latencies, elapsed, errors=0):
+    """Print p50/p95/p99 latency and throughput for a run and return them as a dict."""
+    latencies = np.array(latencies) * 1000
+    result = {
+        'name': name,
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+        'p95_ms': float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+        'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+        'throughput_rps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+    }
+    print(f"{name:<40} n={result['requests']:<6} err={errors:<4} p50={result['p50_ms']:.1f}ms p95={result['p95_ms']:.1f}ms p99={result['p99_ms']:.1f}ms {result['throughput_rps']:.1f} req/s", flush=True)
+    return result
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.elapsed = time.perf_counter() - self.start
@@ -0,0 +1,190 @@
+"""Generate synthetic dashboard/pools/subscan data.
+
+    python -m bench.synthetic --nominators 1000000 --out /tmp/bench_export [--load]
+
+Writes sharded `export/dashboard.<shard>.csv.gz` files in the same layout as the
+BigQuery export, so the directory can be served through BLOB_SOURCE, and with
+--load copies the same rows into the Postgres database from POSTGRES_* env vars.
+pools isn't part of the export, --load creates it like production does, without
+account keys.
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import time
+
+import numpy as np
+import psycopg2
+
+import accounts
+
+DASHBOARD_COLUMNS = [
+    'address', 'lastEraReward', 'rewardYear', 'APY', 'currentStake', 'lastStakeAddition',
+    'totalValidators', 'activeValidators', 'wasActiveInMonth', 'lastActiveEra',
+    'activeEraSuccessRate', 'medianErasFee', 'currentEraFee', 'validatorsCoverage',
+    'validatorsSetChange', 'validatorsMaxFeeInSet', 'highestMinStake', 'tags', 'risks',
+    'activeNominator', 'isPool',
+]
+POOLS_COLUMNS = ['address']
+
+TAGS = np.array(['low activity', 'moderate', 'unstable', 'stable', 'top_performer'])
+RISKS = np.array(['low stake', 'low prob', 'in risk', 'low risk'])
+LAST_ERA = 1500
+MINIMUM_ACTIVE_STAKE = 250 * 10**10
+
+
+def generate_keys(rng, count):
+    return [key.tobytes() for key in rng.integers(0, 256, size=(count, 32), dtype=np.uint8)]
+
+
+def generate_dashboard(rng, count, active_ratio=0.8):
+    """Return dashboard columns as string arrays, roughly matching the production distributions."""
+    active = rng.random(count) < active_ratio
+    stake = np.round(rng.lognormal(mean=6.5, sigma=2.0, size=count), 2)
+    apy = np.round(rng.normal(14.5, 1.5, size=count).clip(0), 2)
+    total_validators = rng.integers(1, 17, size=count)
+    active_validators = np.minimum(rng.binomial(total_validators, 0.4), total_validators)
+    fee = np.round(rng.choice([0.0, 1.0, 2.5, 5.0, 10.0, 100.0], p=[0.05, 0.2, 0.3, 0.3, 0.149, 0.001], size=count), 2)
+
+    def fmt(values):
+        return np.char.mod('%.2f', values)
+
+    def ints(values):
+        return values.astype(str)
+
+    columns = {
+        'lastEraReward': fmt(stake * apy / 100 / 365),
+        'rewardYear': fmt(apy),
+        'APY': fmt(apy),
+        'currentStake': fmt(stake),
+        'lastStakeAddition': ints(rng.integers(0, 365, size=count)),
+        'totalValidators': ints(total_validators),
+        'activeValidators': ints(active_validators),
+        'wasActiveInMonth': np.where(rng.random(count) < 0.9, 'true', 'false'),
+        'lastActiveEra': np.full(count, str(LAST_ERA)),
+        'activeEraSuccessRate': fmt(rng.uniform(50, 100, size=count)),
+        'medianErasFee': fmt(fee),
+        'currentEraFee': fmt(fee),
+        'validatorsCoverage': fmt(active_validators / total_validators * 100),
+        'validatorsSetChange': ints(rng.integers(1, 20, size=count)),
+        'validatorsMaxFeeInSet': ints((fee == 100.0).astype(int)),
+        'highestMinStake': fmt(stake * rng.uniform(1, 3, size=count)),
+        'tags': TAGS[rng.integers(0, len(TAGS), size=count)],
+        'risks': RISKS[rng.integers(0, len(RISKS), size=count)],
+        'activeNominator': np.where(active, '1', '0'),
+        'isPool': np.full(count, 'False').astype(object),
+    }
+    # inactive nominators only carry a stake and a tag, like the UNION ALL branch of dashboard.sql
+    for column in columns:
+        if column not in ('currentStake', 'tags', 'activeNominator', 'isPool'):
+            columns[column] = np.where(active, columns[column], '').astype(object)
+    columns['isPool'][~active] = 'INACTIVE'
+    return columns
+
+
+def write_shard(directory, table_name, shard, header, rows):
+    export = os.path.join(directory, 'export')
+    os.makedirs(export, exist_ok=True)
+    path = os.path.join(export, f"{table_name}.{shard:012d}.csv.gz")
+    with gzip.open(path, 'wt', newline='', compresslevel=6) as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return path
+
+
+def create_table(db, table_name, header, keyed=True):
+    """Create the table the way the nightly import does, all text plus the account key."""
+    with db.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {table_name}")
+        columns = ", ".join(f"\"{column}\" text" for column in header)
+        if keyed:
+            cur.execute(f"CREATE TABLE {table_name} ({columns}, {accounts.ACCOUNT_KEY_COLUMN} bytea)")
+            cur.execute(f"CREATE INDEX ON {table_name} ({accounts.ACCOUNT_KEY_COLUMN})")
+        else:
+            cur.execute(f"CREATE TABLE {table_name} ({columns})")
+    db.commit()
+
+
+def copy_rows(db, table_name, rows, keys=None):
+    buffer = io.StringIO()
+    if keys is None:
+        csv.writer(buffer).writerows(rows)
+    else:
+        csv.writer(buffer).writerows(row + ('\\x' + key.hex(),) for row, key in zip(rows, keys))
+    buffer.seek(0)
+    with db.cursor() as cur:
+        cur.copy_expert(f"COPY {table_name} FROM STDIN CSV", buffer)
+    db.commit()
+
+
+def load_subscan(db):
+    data = {
+        "era": LAST_ERA,
+        "totalValidatorCount": 2000,
+        "currentValidatorCount": 297,
+        "totalIssuance": 14500000000 * 10**10,
+        "totalStaked": 7800000000 * 10**10,
+        "numAuctions": 0,
+        "inflation": "7.99",
+        "minimumActiveStake": MINIMUM_ACTIVE_STAKE,
+        "percentageStaked": "0.54",
+        "dotPrice": 6.5,
+    }
+    with db.cursor() as cur:
+        cur.execute("CREATE TABLE IF NOT EXISTS subscan (id SERIAL PRIMARY KEY, era_id INTEGER, timestamp INTEGER, data JSONB)")
+        cur.execute("INSERT INTO subscan (era_id, timestamp, data) VALUES (%s, %s, %s)", (LAST_ERA, int(time.time()), json.dumps(data)))
+    db.commit()
+
+
+def generate(nominators, pools, out, shard_rows, seed, load):
+    """Generate the data shard by shard so memory stays flat at millions of nominators."""
+    rng = np.random.default_rng(seed)
+    db = None
+    if load:
+        db = psycopg2.connect(f"dbname={os.environ['POSTGRES_DB']} user={os.environ['POSTGRES_USER']} password={os.environ['POSTGRES_PASSWORD']} host={os.environ['POSTGRES_HOST']}")
+        create_table(db, 'dashboard', DASHBOARD_COLUMNS)
+        create_table(db, 'pools', POOLS_COLUMNS, keyed=False)
+        load_subscan(db)
+
+    start = time.time()
+    pools_rows = []
+    for shard, offset in enumerate(range(0, nominators, shard_rows)):
+        count = min(shard_rows, nominators - offset)
+        keys = generate_keys(rng, count)
+        addresses = [accounts.ss58_encode(key) for key in keys]
+        columns = generate_dashboard(rng, count)
+        # the first nominators double as pools
+        for i in range(min(pools - len(pools_rows), count)):
+            columns['isPool'][i] = 'True'
+            pools_rows.append((addresses[i],))
+        rows = list(zip(addresses, *(columns[column] for column in DASHBOARD_COLUMNS[1:])))
+
+        if out:
+            write_shard(out, 'dashboard', shard, DASHBOARD_COLUMNS, rows)
+        if db:
+            copy_rows(db, 'dashboard', rows, keys)
+        print(f"Generated {offset + count} nominators in {time.time() - start:.1f} seconds", flush=True)
+
+    if db:
+        copy_rows(db, 'pools', pools_rows)
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nominators', type=int, default=100000)
+    parser.add_argument('--pools', type=int, default=100)
+    parser.add_argument('--out', help="directory for the sharded .csv.gz export")
+    parser.add_argument('--shard-rows', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--load', action='store_true', help="load the data into Postgres")
+    args = parser.parse_args()
+    generate(args.nominators, args.pools, args.out, args.shard_rows, args.seed, args.load)
+
+
+if __name__ == '__main__':
+    main()
@@ -930,6 +930,7 @@ SELECT Distinct
     an.currentEraFee,
     an.validatorsCoverage,
     an.validatorsSetChange,
+    an.validatorsMaxFeeInSet,
     an.highestMinStake,
     an.tags,
     -- an.tagsOld,
@@ -958,6 +959,7 @@ SELECT
     NULL AS currentEraFee,
     NULL AS validatorsCoverage,
     NULL AS validatorsSetChange,
+    NULL AS validatorsMaxFeeInSet,
     NULL AS highestMinStake,
     fina.tags AS tags,
     NULL AS risks,
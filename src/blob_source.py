@@ -0,0 +1,50 @@
+import os
+import shutil
+
+DEFAULT_BLOB_SOURCE = 'gs://export-bucket'
+
+
+class LocalBlob:
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+
+    def download_to_file(self, file_obj):
+        with open(self.path, 'rb') as src:
+            shutil.copyfileobj(src, file_obj)
+
+
+class LocalBlobSource:
+    """Serves `<directory>/export/*.csv.gz` the same way the GCS bucket does, used for benchmarks and local runs."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def list_blobs(self, prefix=''):
+        blobs = []
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                if name.startswith(prefix):
+                    blobs.append(LocalBlob(path, name))
+        return sorted(blobs, key=lambda blob: blob.name)
+
+
+class GCSBlobSource:
+    def __init__(self, bucket_name):
+        from google.cloud import storage
+        self.bucket = storage.Client().bucket(bucket_name)
+
+    def list_blobs(self, prefix=''):
+        return self.bucket.list_blobs(prefix=prefix)
+
+
+def get_blob_source(uri=None):
+    """Resolve BLOB_SOURCE (gs://bucket or a local directory) to a blob source."""
+    uri = uri or os.environ.get('BLOB_SOURCE', DEFAULT_BLOB_SOURCE)
+    if uri.startswith('gs://'):
+        return GCSBlobSource(uri[len('gs://'):].strip('/'))
+    if uri.startswith('file://'):
+        uri = uri[len('file://'):]
+    return LocalBlobSource(uri)
@@ -2,24 +2,31 @@ import logging
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, ConversationHandler, CallbackContext, MessageHandler, Filters
 import telegram
-import openai
-import psycopg2
-import psycopg2, psycopg2.pool
 from psycopg2.extras import RealDictCursor
 import re
 import os, time, json, traceback
 from decimal import Decimal
 import queue, threading 
 
+import metrics
+import accounts
+import database
+
 # Set up logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# OpenAI API Key set as env var
-client = openai.OpenAI()
+_client = None
+
+
+def openai_client():
+    """OpenAI client, created on first use. API key set as env var."""
+    global _client
+    if _client is None:
+        import openai
+        _client = openai.OpenAI()
+    return _client
 
-# Database connection pool
-pool = psycopg2.pool.SimpleConnectionPool(1, 20, f"dbname={os.environ['POSTGRES_DB']} user={os.environ['POSTGRES_USER']} password={os.environ['POSTGRES_PASSWORD']} host={os.environ['POSTGRES_HOST']}")
 
 RATE_LIMIT_SECONDS = 60  # Time frame
 USER_LIMIT = 5  # Number of requests in time frame
@@ -33,12 +40,16 @@ class DecimalEncoder(json.JSONEncoder):
     return json.JSONEncoder.default(self, obj)
 
 class ConnectionFromPool:
+    def __init__(self, readonly=False):
+        self.readonly = readonly
+
     def __enter__(self):
-        self.conn = pool.getconn()
+        # users and messages are written to the primary, lookups may read a replica
+        self.pool, self.conn = database.get_router().getconn(readonly=self.readonly, name='bot')
         return self.conn
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        pool.putconn(self.conn)
+        database.get_router().putconn(self.pool, self.conn)
 
 
 def rate_limited(user_id):
@@ -78,33 +89,47 @@ def start(update: Update, context: CallbackContext):
 
 
 def save_address(user_id, polkadot_address):
-    """Save Polkadot address to the database."""
+    """Save Polkadot address to the database, returns whether it is a known nominator."""
+    # any SS58 format of the same account matches, the dashboard's address is stored for display
+    account_key = accounts.try_account_key(polkadot_address)
     with ConnectionFromPool() as conn:
         try:
             with conn.cursor() as cur:
-                cur.execute("CREATE TABLE IF NOT EXISTS users (user_id BIGINT PRIMARY KEY, polkadot_address TEXT, thread_id TEXT)")
-                cur.execute("SELECT 1 FROM dashboard WHERE address = %s", (polkadot_address,))
-                if cur.fetchone() is None:
-                    polkadot_address = None
-                cur.execute("INSERT INTO users (user_id, polkadot_address) VALUES (%s, %s) ON CONFLICT (user_id) DO UPDATE SET polkadot_address = EXCLUDED.polkadot_address", (user_id, polkadot_address))
+                cur.execute("CREATE TABLE IF NOT EXISTS users (user_id BIGINT PRIMARY KEY, polkadot_address TEXT, thread_id TEXT, account_key BYTEA)")
+                polkadot_address = None
+                if account_key:
+                    cur.execute("SELECT address FROM dashboard WHERE account_key = %s", (account_key,))
+                    res = cur.fetchone()
+                    if res:
+                        polkadot_address = res[0]
+                    else:
+                        account_key = None
+                cur.execute("INSERT INTO users (user_id, polkadot_address, account_key) VALUES (%s, %s, %s) ON CONFLICT (user_id) DO UPDATE SET polkadot_address = EXCLUDED.polkadot_address, account_key = EXCLUDED.account_key", (user_id, polkadot_address, account_key))
             conn.commit()
+            return polkadot_address is not None
         except Exception as e:
             logger.error(f"Database error: {e}")
             conn.rollback()
+            return False
 
 def fetch_relevant_data(address):
     result = {}
-    dashboard_query = f"SELECT * FROM dashboard WHERE address = '{address}'"
+    account_key = accounts.try_account_key(address)
+    dashboard_query = "SELECT * FROM dashboard WHERE account_key = %s"
     subscan_query = f"SELECT * FROM subscan ORDER BY timestamp DESC LIMIT 1"
     
-    with ConnectionFromPool() as conn:
+    with ConnectionFromPool(readonly=True) as conn:
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(dashboard_query)
-                result['dashboard'] = cur.fetchone()
+                result['dashboard'] = None
+                if account_key:
+                    cur.execute(dashboard_query, (account_key,))
+                    result['dashboard'] = cur.fetchone()
                 if result['dashboard'] is None:
                     result['dashboard'] = {}
                 else:
+                    # raw key bytes aren't useful to the assistant
+                    result['dashboard'].pop(accounts.ACCOUNT_KEY_COLUMN, None)
                     # replace None with 0 and ensure numerical values are cast correctly
                     for key, value in result['dashboard'].items():
                         if value is None:
@@ -143,12 +168,14 @@ def fetch_relevant_data(address):
                     else:
                         # replace None with 0 and ensure numerical values are cast correctly
                         for top in result['top']:
+                            top.pop(accounts.ACCOUNT_KEY_COLUMN, None)
                             for key, value in top.items():
                                 if value is None:
                                     top[key] = 0
                                 elif isinstance(value, str) and value.isdigit():
                                     top[key] = int(value)
 
+            result['recommendation'] = accounts.get_recommendation(conn, address) or {}
             conn.commit()
 
         except Exception as e:
@@ -163,9 +190,11 @@ def response_format(message):
 
 def update_message(context, chat_id, message_id, message):
     try:
-        context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=response_format(message), parse_mode=telegram.ParseMode.MARKDOWN)
+        with metrics.TELEGRAM_EDIT_LATENCY.time():
+            context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=response_format(message), parse_mode=telegram.ParseMode.MARKDOWN)
         return message
     except telegram.error.RetryAfter as e:
+        metrics.TELEGRAM_THROTTLED.labels('edit_message_text').inc()
         time.sleep(5)
         update_message(context, chat_id, message_id, message)
     except Exception as e:
@@ -180,20 +209,25 @@ def download_message(thread_id, _queue):
     message = ""
     analyzing_message = "Analyzing data"
     dots = 0
+    start = time.perf_counter()
+    first_token = True
     while True:
         try:
-            with client.beta.threads.runs.stream(
+            with openai_client().beta.threads.runs.stream(
                 thread_id=thread_id,
                 assistant_id=os.environ['OPENAI_ASSISTANT_ID'],
             ) as stream:
                 for event in stream:
                     if event.event == "thread.message.delta" and event.data.delta.content:
+                        if first_token:
+                            metrics.OPENAI_FIRST_TOKEN.observe(time.perf_counter() - start)
+                            first_token = False
                         message += event.data.delta.content[0].text.value
                         _queue.put(message)
                     elif event.event == "thread.run.requires_action":
                         address = json.loads(event.data.required_action.submit_tool_outputs.tool_calls[0].function.arguments)['address']
                         result = fetch_relevant_data(address)
-                        client.beta.threads.runs.submit_tool_outputs(
+                        openai_client().beta.threads.runs.submit_tool_outputs(
                             thread_id=thread_id,
                             run_id=event.data.id,
                             tool_outputs=[
@@ -203,6 +237,7 @@ def download_message(thread_id, _queue):
                                 },
                             ])
                     elif event.event == "thread.message.completed":
+                        metrics.OPENAI_TOTAL.observe(time.perf_counter() - start)
                         _queue.put("$$END$$" + message)
                         return
                     elif event.event == "thread.run.failed":
@@ -243,23 +278,23 @@ def ask_openai(prompt, user_id, context, message_id, chat_id):
                     thread_id = res.get('thread_id')
                     polkadot_address = res.get('polkadot_address', "NOADDRESS")
                     if not thread_id:
-                        thread = client.beta.threads.create()
+                        thread = openai_client().beta.threads.create()
                         thread_id = thread.id
                         cur.execute("UPDATE users SET thread_id = %s WHERE user_id = %s", (thread_id, user_id))
                 else:
-                    thread = client.beta.threads.create()
+                    thread = openai_client().beta.threads.create()
                     thread_id = thread.id
                     cur.execute("INSERT INTO users (user_id, thread_id) VALUES (%s, %s)", (user_id, thread_id))
                 conn.commit()
 
         # Check for active runs and stop them if necessary
-        active_runs = client.beta.threads.runs.list(thread_id=thread_id)
+        active_runs = openai_client().beta.threads.runs.list(thread_id=thread_id)
         for run in active_runs:
             if run.status == "active":
-                client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
+                openai_client().beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
 
         formatted_prompt = f"Polkadot address: {polkadot_address}\n\n{prompt}" 
-        client.beta.threads.messages.create(thread_id=thread_id, role="user", content=formatted_prompt)
+        openai_client().beta.threads.messages.create(thread_id=thread_id, role="user", content=formatted_prompt)
 
         _queue = queue.LifoQueue()
         download_thread = threading.Thread(target=download_message, args=(thread_id, _queue))
@@ -389,7 +424,11 @@ def button_handler(update: Update, context: CallbackContext):
                                     tips.add(f"🔒 **Increase your stake** to at least `{int(result['subscan']['data']['minimumActiveStake']) / 10**10} DOT` to meet the minimum active stake.")
                                 if dashboard_activeValidators < 1:
                                     tips.add("🔧 **Ensure you have at least one active validator.**")
-                                    
+
+                            recommendation = result.get("recommendation")
+                            if recommendation and recommendation.get("pool_address") and recommendation["pool_address"] != result["dashboard"].get("address"):
+                                tips.add(f"🏊 **Consider joining pool** `{recommendation['pool_address']}` with `{recommendation['poolAPY']}%` APY, it matches your staking profile.")
+
                             message = f"{active_status}\n\n"
                             if tips:
                                 message += "Here are some tips to improve your performance:\n"
@@ -414,7 +453,7 @@ def button_handler(update: Update, context: CallbackContext):
 
 def provision_assistant():
     with open('fetch_relevant_data.jsonl', 'r') as file:
-        updated_assistant = client.beta.assistants.update(
+        updated_assistant = openai_client().beta.assistants.update(
             os.environ['OPENAI_ASSISTANT_ID'],
             tools=[
                 {"type": "function", "function": json.load(file)}
@@ -449,8 +488,34 @@ Refer them to these links when relevant:
         return updated_assistant
 
 
+def provision_assistant_in_background():
+    def provision():
+        try:
+            provision_assistant()
+            logger.info("Assistant provisioned")
+        except Exception as e:
+            logger.error(f"Failed to provision assistant: {e}")
+            traceback.print_exc()
+    threading.Thread(target=provision, daemon=True).start()
+
+
+def backfill_user_keys_in_background():
+    def backfill():
+        try:
+            with ConnectionFromPool() as conn:
+                accounts.backfill_user_keys(conn)
+        except Exception as e:
+            # the nightly alert run retries it
+            logger.error(f"Failed to backfill user account keys: {e}")
+            traceback.print_exc()
+    threading.Thread(target=backfill, daemon=True).start()
+
+
 def main():
-    provision_assistant()
+    # neither blocks polling, a database hiccup at startup mustn't keep the bot offline
+    backfill_user_keys_in_background()
+    # polling doesn't need the assistant's tools updated, only answering does
+    provision_assistant_in_background()
     # Create the Updater and pass it your bot's token.
     updater = Updater(os.environ['TELEGRAM_BOT_TOKEN'], use_context=True)
 
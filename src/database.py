@@ -0,0 +1,216 @@
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.pool
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# comma separated host[:port] of read replicas, reads use the primary when unset
+REPLICA_HOSTS = [host for host in os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(',') if host.strip()]
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', 5))
+# how many load generations of any table a replica may trail the primary by and still serve reads
+REPLICA_MAX_GENERATIONS_BEHIND = int(os.environ.get('REPLICA_MAX_GENERATIONS_BEHIND', 0))
+CHECK_TIMEOUT_SECONDS = 2
+# shared by the api, ingest and bot of one process
+POOL_SIZE = int(os.environ.get('POSTGRES_POOL_SIZE', 40))
+
+GENERATIONS_QUERY = "SELECT table_name, generation FROM load_generations"
+
+
+def dsn(host):
+    """DSN for the configured database on `host`, which may carry a :port suffix."""
+    host = host.strip()
+    port = None
+    if ':' in host and host.rsplit(':', 1)[1].isdigit():
+        host, port = host.rsplit(':', 1)
+    return (f"dbname={os.environ['POSTGRES_DB']} user={os.environ['POSTGRES_USER']} password={os.environ['POSTGRES_PASSWORD']} host={host}"
+            + (f" port={port}" if port else ""))
+
+
+PRIMARY_DSN = dsn(os.environ['POSTGRES_HOST'])
+REPLICA_DSNS = [dsn(host) for host in REPLICA_HOSTS]
+
+
+def bump_generation(db, table_name):
+    """Mark a finished load of table_name, replicas that haven't replayed it yet are stale."""
+    with db.cursor() as cur:
+        cur.execute("CREATE TABLE IF NOT EXISTS load_generations (table_name TEXT PRIMARY KEY, generation BIGINT NOT NULL, loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+        cur.execute("""
+            INSERT INTO load_generations (table_name, generation) VALUES (%s, 1)
+            ON CONFLICT (table_name) DO UPDATE SET generation = load_generations.generation + 1, loaded_at = CURRENT_TIMESTAMP
+        """, (table_name,))
+    db.commit()
+
+
+def load_generations(dsn):
+    """Generation of every loaded table on the server behind dsn."""
+    db = psycopg2.connect(dsn, connect_timeout=CHECK_TIMEOUT_SECONDS, options=f"-c statement_timeout={CHECK_TIMEOUT_SECONDS * 1000}")
+    try:
+        with db.cursor() as cur:
+            cur.execute("SELECT to_regclass('load_generations')")
+            if cur.fetchone()[0] is None:
+                return {}
+            cur.execute(GENERATIONS_QUERY)
+            return dict(cur.fetchall())
+    finally:
+        db.close()
+
+
+class ReplicaPool(psycopg2.pool.ThreadedConnectionPool):
+    def close_idle(self):
+        """Close the pooled connections nobody has checked out, the ones in use come back through putconn."""
+        with self._lock:
+            for conn in self._pool:
+                conn.close()
+            self._pool.clear()
+
+
+class Replica:
+    def __init__(self, name, dsn, maxconn):
+        self.name = name
+        self.dsn = dsn
+        self.maxconn = maxconn
+        # the pool is only opened once the replica passed a check, it may well be down at startup
+        self.pool = None
+        self.healthy = False
+        self.behind = None
+
+    def open(self):
+        if self.pool is None:
+            self.pool = ReplicaPool(1, self.maxconn, self.dsn)
+
+    def reset(self):
+        """Drop the idle connections, they point at a server that went away."""
+        if self.pool is not None:
+            self.pool.close_idle()
+
+
+class Router:
+    """Hands out primary connections for writes and replica connections for reads.
+
+    A background thread checks every replica each REPLICA_CHECK_INTERVAL seconds.
+    A replica serves reads only while it answers and has replayed the primary's
+    load generations, within REPLICA_MAX_GENERATIONS_BEHIND. Otherwise, and
+    until its first check passes, reads go to the primary.
+    """
+
+    def __init__(self, name, primary_dsn=PRIMARY_DSN, replica_dsns=REPLICA_DSNS, maxconn=POOL_SIZE):
+        self.name = name
+        self.primary_dsn = primary_dsn
+        self.primary = psycopg2.pool.ThreadedConnectionPool(1, maxconn, primary_dsn)
+        self.replicas = [Replica(f"replica{i}", replica_dsn, maxconn) for i, replica_dsn in enumerate(replica_dsns)]
+        self.next_replica = 0
+        self.checker = None
+        self.lock = threading.Lock()
+
+    def getconn(self, readonly=False, name=None):
+        """Returns (pool, connection), hand both back to putconn. `name` labels the checkout in metrics."""
+        name = name or self.name
+        if readonly and self.replicas:
+            self.start_checker()
+            for replica in self.usable_replicas():
+                pool = replica.pool
+                if pool is None:
+                    continue
+                try:
+                    conn = metrics.checkout(pool, f"{name}.{replica.name}")
+                except psycopg2.pool.PoolError:
+                    # a busy replica is still a healthy one, just spill over to the next or the primary
+                    continue
+                except psycopg2.OperationalError as e:
+                    logger.warning(f"Replica {replica.name} unavailable, trying the next one: {e}")
+                    self.mark_unhealthy(replica)
+                    continue
+                metrics.READ_ROUTED.labels(name, 'replica').inc()
+                return pool, conn
+            metrics.READ_ROUTED.labels(name, 'primary').inc()
+        return self.primary, metrics.checkout(self.primary, name)
+
+    def putconn(self, pool, conn):
+        if conn.closed and pool is not self.primary:
+            # the server went away mid-request, stop reading from it until it passes a check again
+            for replica in self.replicas:
+                if replica.pool is pool:
+                    self.mark_unhealthy(replica)
+        pool.putconn(conn, close=bool(conn.closed))
+
+    def usable_replicas(self):
+        with self.lock:
+            usable = [replica for replica in self.replicas if replica.healthy]
+            self.next_replica += 1
+        if not usable:
+            return []
+        start = self.next_replica % len(usable)
+        return usable[start:] + usable[:start]
+
+    def mark_unhealthy(self, replica):
+        with self.lock:
+            if not replica.healthy:
+                return
+            replica.healthy = False
+        metrics.REPLICA_HEALTHY.labels(self.name, replica.name).set(0)
+        replica.reset()
+
+    def start_checker(self):
+        with self.lock:
+            if self.checker is not None:
+                return
+            self.checker = threading.Thread(target=self.check_loop, name=f"{self.name}-replica-check", daemon=True)
+        self.checker.start()
+
+    def check_loop(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Replica check failed: {e}")
+            time.sleep(REPLICA_CHECK_INTERVAL)
+
+    def check(self):
+        """Update the health and staleness of every replica against the primary."""
+        try:
+            primary = load_generations(self.primary_dsn)
+        except psycopg2.Error as e:
+            # without the primary's generations staleness can't be judged, keep the last verdict
+            logger.warning(f"Can't read load generations from the primary: {e}")
+            return
+        for replica in self.replicas:
+            try:
+                generations = load_generations(replica.dsn)
+            except psycopg2.Error as e:
+                if replica.healthy:
+                    logger.warning(f"Replica {replica.name} failed its health check: {e}")
+                self.mark_unhealthy(replica)
+                continue
+            replica.behind = max((generation - generations.get(table_name, 0) for table_name, generation in primary.items()), default=0)
+            metrics.REPLICA_GENERATIONS_BEHIND.labels(self.name, replica.name).set(replica.behind)
+            usable = replica.behind <= REPLICA_MAX_GENERATIONS_BEHIND
+            if usable:
+                try:
+                    replica.open()
+                except psycopg2.Error as e:
+                    logger.warning(f"Replica {replica.name} failed to open its pool: {e}")
+                    continue
+            if usable != replica.healthy:
+                logger.info(f"Replica {replica.name} is {'serving reads' if usable else f'{replica.behind} generations behind, reading from the primary'}")
+            with self.lock:
+                replica.healthy = usable
+            metrics.REPLICA_HEALTHY.labels(self.name, replica.name).set(int(usable))
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """The router shared by everything in this process, created on first use so roles without a database never open one."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = Router('db')
+        return _router
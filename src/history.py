@@ -0,0 +1,138 @@
+import datetime
+import os
+
+# daily partitions are kept for DAILY_DAYS, then rolled up to the last state of
+# each address per month, monthly partitions are dropped after RETENTION_DAYS
+HISTORY_DAILY_DAYS = int(os.environ.get('HISTORY_DAILY_DAYS', 90))
+HISTORY_RETENTION_DAYS = int(os.environ.get('HISTORY_RETENTION_DAYS', 730))
+
+DAILY_PREFIX = 'dashboard_history_d'
+MONTHLY_PREFIX = 'dashboard_history_m'
+
+# only rows that differ from the previous generation are stored
+APPEND_QUERY = """
+INSERT INTO dashboard_history (snapshot_date, account_key, address, data)
+SELECT %(snapshot_date)s, n.account_key, n.address, to_jsonb(n) - 'account_key'
+FROM dashboard n
+LEFT JOIN dashboard_previous p ON p.account_key = n.account_key
+WHERE n.account_key IS NOT NULL
+  AND (p.account_key IS NULL OR (to_jsonb(n) - 'account_key') IS DISTINCT FROM (to_jsonb(p) - 'account_key'))
+ON CONFLICT (account_key, snapshot_date) DO UPDATE SET data = EXCLUDED.data, address = EXCLUDED.address
+"""
+
+APPEND_ALL_QUERY = """
+INSERT INTO dashboard_history (snapshot_date, account_key, address, data)
+SELECT %(snapshot_date)s, n.account_key, n.address, to_jsonb(n) - 'account_key'
+FROM dashboard n
+WHERE n.account_key IS NOT NULL
+ON CONFLICT (account_key, snapshot_date) DO UPDATE SET data = EXCLUDED.data, address = EXCLUDED.address
+"""
+
+
+def create_history_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS dashboard_history (
+            snapshot_date DATE NOT NULL,
+            account_key BYTEA NOT NULL,
+            address TEXT NOT NULL,
+            data JSONB NOT NULL
+        ) PARTITION BY RANGE (snapshot_date)
+    """)
+    # serves both the upsert and the per-address time series range scan
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS dashboard_history_key_date_idx ON dashboard_history (account_key, snapshot_date)")
+
+
+def create_partition(cur, name, start, end):
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF dashboard_history FOR VALUES FROM ('{start}') TO ('{end}')")
+
+
+def append_snapshot(db, snapshot_date=None):
+    """Append the rows of the freshly imported dashboard that changed since the previous generation."""
+    snapshot_date = snapshot_date or datetime.date.today()
+    with db.cursor() as cur:
+        create_history_table(cur)
+        create_partition(cur, f"{DAILY_PREFIX}{snapshot_date:%Y%m%d}", snapshot_date, snapshot_date + datetime.timedelta(days=1))
+        cur.execute("SELECT to_regclass('dashboard_previous'), EXISTS (SELECT 1 FROM dashboard_history)")
+        previous, has_history = cur.fetchone()
+        # without a previous generation or any history yet the first snapshot is the baseline
+        cur.execute(APPEND_QUERY if previous and has_history else APPEND_ALL_QUERY, {'snapshot_date': snapshot_date})
+        rows = cur.rowcount
+    db.commit()
+    return rows
+
+
+def list_partitions(cur):
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'dashboard_history'::regclass
+    """)
+    return [row[0] for row in cur.fetchall()]
+
+
+def roll_up_month(cur, month, partitions):
+    """Replace the daily partitions of a month with one partition holding the last state of each address."""
+    name = f"{MONTHLY_PREFIX}{month:%Y%m}"
+    next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+    cur.execute(f"""
+        CREATE TEMP TABLE history_rollup ON COMMIT DROP AS
+        SELECT DISTINCT ON (account_key) snapshot_date, account_key, address, data
+        FROM dashboard_history
+        WHERE snapshot_date >= '{month}' AND snapshot_date < '{next_month}'
+        ORDER BY account_key, snapshot_date DESC
+    """)
+    for partition in partitions:
+        cur.execute(f"DROP TABLE {partition}")
+    create_partition(cur, name, month, next_month)
+    cur.execute(f"INSERT INTO {name} SELECT * FROM history_rollup")
+
+
+def apply_retention(db, today=None):
+    """Roll up daily partitions older than HISTORY_DAILY_DAYS into months and drop months older than HISTORY_RETENTION_DAYS."""
+    today = today or datetime.date.today()
+    daily_cutoff = today - datetime.timedelta(days=HISTORY_DAILY_DAYS)
+    retention_cutoff = today - datetime.timedelta(days=HISTORY_RETENTION_DAYS)
+    with db.cursor() as cur:
+        cur.execute("SELECT to_regclass('dashboard_history')")
+        if cur.fetchone()[0] is None:
+            return
+        months = {}
+        for partition in list_partitions(cur):
+            if partition.startswith(DAILY_PREFIX):
+                day = datetime.datetime.strptime(partition[len(DAILY_PREFIX):], '%Y%m%d').date()
+                months.setdefault(day.replace(day=1), []).append(partition)
+            elif partition.startswith(MONTHLY_PREFIX):
+                month = datetime.datetime.strptime(partition[len(MONTHLY_PREFIX):], '%Y%m').date()
+                next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+                if next_month <= retention_cutoff:
+                    cur.execute(f"DROP TABLE {partition}")
+
+        for month, partitions in months.items():
+            next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+            # only whole months past the cutoff are rolled up
+            if next_month <= daily_cutoff:
+                roll_up_month(cur, month, partitions)
+                db.commit()
+    db.commit()
+
+
+def address_history(cur, account_key, days=None):
+    """Time series of one account, newest last.
+
+    Only changes are stored, so with `days` the newest row before the window is
+    included too, it holds the values the window starts with.
+    """
+    if days:
+        cur.execute("""
+            (SELECT snapshot_date, data FROM dashboard_history
+             WHERE account_key = %(key)s AND snapshot_date < CURRENT_DATE - %(days)s
+             ORDER BY snapshot_date DESC LIMIT 1)
+            UNION ALL
+            (SELECT snapshot_date, data FROM dashboard_history
+             WHERE account_key = %(key)s AND snapshot_date >= CURRENT_DATE - %(days)s)
+            ORDER BY snapshot_date
+        """, {'key': account_key, 'days': days})
+    else:
+        cur.execute("SELECT snapshot_date, data FROM dashboard_history WHERE account_key = %s ORDER BY snapshot_date", (account_key,))
+    return [{'snapshot_date': snapshot_date.isoformat(), **data} for snapshot_date, data in cur.fetchall()]
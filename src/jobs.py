@@ -0,0 +1,172 @@
+import logging
+import socket
+import threading
+import time
+import traceback
+import zlib
+
+import psycopg2
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SKIP = 'skip'
+QUEUE = 'queue'
+
+
+class Job:
+    def __init__(self, name, func, max_runtime, overlap=SKIP):
+        self.name = name
+        self.func = func
+        self.max_runtime = max_runtime
+        self.overlap = overlap
+        # advisory locks take a bigint, derive a stable one from the name
+        self.lock_id = zlib.crc32(f"job:{name}".encode())
+        self.running = False
+        self.pending = False
+
+
+class JobRunner:
+    """Runs every job on its own thread, at most once across replicas.
+
+    A run takes a Postgres advisory lock on a dedicated connection so another
+    replica triggering the same job skips it. Triggers arriving while a job is
+    still running are skipped, or for QUEUE jobs run once afterwards. Every run,
+    including skipped ones, is recorded in job_runs. A run past its max_runtime
+    is reported as timed out, it keeps its lock until it actually finishes.
+    A job function may return the number of rows it processed.
+    """
+
+    def __init__(self, dsn, notify=None):
+        self.dsn = dsn
+        self.notify = notify or (lambda message: logger.info(message))
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.host = socket.gethostname()
+
+    def add(self, name, func, max_runtime, overlap=SKIP):
+        self.jobs[name] = Job(name, func, max_runtime, overlap)
+
+    def connect(self):
+        db = psycopg2.connect(self.dsn)
+        db.autocommit = True
+        with db.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS job_runs (
+                    id SERIAL PRIMARY KEY,
+                    job TEXT NOT NULL,
+                    host TEXT,
+                    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP,
+                    duration REAL,
+                    rows BIGINT,
+                    outcome TEXT,
+                    error TEXT
+                )
+            """)
+        return db
+
+    def record(self, db, job, outcome, error=None):
+        with db.cursor() as cur:
+            cur.execute("INSERT INTO job_runs (job, host, finished_at, duration, outcome, error) VALUES (%s, %s, CURRENT_TIMESTAMP, 0, %s, %s)", (job.name, self.host, outcome, error))
+        metrics.JOB_RUNS.labels(job.name, outcome).inc()
+
+    def trigger(self, name):
+        """Start a run of job `name` in the background, meant to be called from the scheduler."""
+        job = self.jobs[name]
+        with self.lock:
+            if job.running:
+                if job.overlap == QUEUE:
+                    job.pending = True
+                    return
+                outcome = 'skipped_overlap'
+            else:
+                job.running = True
+                outcome = None
+        if outcome:
+            self._record_skip(job, outcome)
+            return
+        threading.Thread(target=self._run, args=(job,), name=f"job-{name}", daemon=True).start()
+
+    def _record_skip(self, job, outcome):
+        try:
+            db = self.connect()
+            try:
+                self.record(db, job, outcome)
+            finally:
+                db.close()
+        except Exception as e:
+            logger.error(f"Failed to record {outcome} run of {job.name}: {e}")
+
+    def _run(self, job):
+        try:
+            while True:
+                self._run_once(job)
+                with self.lock:
+                    if not job.pending:
+                        job.running = False
+                        return
+                    job.pending = False
+        except BaseException:
+            with self.lock:
+                job.running = False
+            raise
+
+    def _run_once(self, job):
+        try:
+            db = self.connect()
+        except Exception as e:
+            self.notify(f"Job {job.name} could not connect to the database: {e}")
+            return
+
+        try:
+            with db.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (job.lock_id,))
+                if not cur.fetchone()[0]:
+                    self.record(db, job, 'skipped_locked')
+                    return
+                cur.execute("INSERT INTO job_runs (job, host) VALUES (%s, %s) RETURNING id", (job.name, self.host))
+                run_id = cur.fetchone()[0]
+
+            timed_out = threading.Event()
+
+            def deadline():
+                timed_out.set()
+                self.notify(f"Job {job.name} exceeded its max runtime of {job.max_runtime} seconds")
+
+            watchdog = threading.Timer(job.max_runtime, deadline)
+            watchdog.daemon = True
+            watchdog.start()
+
+            start = time.perf_counter()
+            rows, outcome, error = None, 'success', None
+            try:
+                result = job.func()
+                if isinstance(result, int):
+                    rows = result
+            except Exception as e:
+                # tasks send their own error notifications
+                outcome, error = 'failed', str(e)
+                logger.error(f"Job {job.name} failed: {e}")
+                traceback.print_exc()
+            finally:
+                watchdog.cancel()
+            duration = time.perf_counter() - start
+            if timed_out.is_set() and outcome == 'success':
+                outcome = 'timeout'
+
+            with db.cursor() as cur:
+                cur.execute(
+                    "UPDATE job_runs SET finished_at = CURRENT_TIMESTAMP, duration = %s, rows = %s, outcome = %s, error = %s WHERE id = %s",
+                    (duration, rows, outcome, error, run_id),
+                )
+                cur.execute("SELECT pg_advisory_unlock(%s)", (job.lock_id,))
+            metrics.JOB_RUNS.labels(job.name, outcome).inc()
+            metrics.JOB_DURATION.labels(job.name).observe(duration)
+        except Exception as e:
+            logger.error(f"Job runner error in {job.name}: {e}")
+            traceback.print_exc()
+        finally:
+            # closing the session also releases the advisory lock
+            db.close()
@@ -0,0 +1,105 @@
+import os
+import time
+from contextlib import contextmanager
+
+import psycopg2.pool
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, start_http_server, CONTENT_TYPE_LATEST
+
+# processes without the API serve /metrics on their own port
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9100))
+
+# API
+ROUTE_LATENCY = Histogram('api_request_seconds', 'Latency of API requests', ['route', 'method', 'status'])
+QUERY_LATENCY = Histogram('db_query_seconds', 'Latency of database queries', ['query'])
+SERIALIZE_LATENCY = Histogram('api_serialize_seconds', 'Time spent serializing responses', ['route'])
+# psycopg2 pools never block, waiting happens in the admission queue in front of them
+POOL_ERRORS = Counter('db_pool_checkout_errors_total', 'Failed connection checkouts, exhausted pool or failed connect', ['pool', 'reason'])
+ADMISSION_WAIT = Histogram('api_admission_wait_seconds', 'Time requests spent queued for a route slot', ['route'],
+                           buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0))
+ADMISSION_REJECTED = Counter('api_admission_rejected_total', 'Requests shed with a 503', ['route', 'reason'])
+
+# Read replicas
+READ_ROUTED = Counter('db_reads_routed_total', 'Read-only checkouts by the server they went to', ['pool', 'target'])
+REPLICA_HEALTHY = Gauge('db_replica_serving', 'Whether a replica passed its last health and staleness check', ['pool', 'replica'])
+REPLICA_GENERATIONS_BEHIND = Gauge('db_replica_generations_behind', 'Load generations a replica trails the primary by', ['pool', 'replica'])
+
+# Ingest
+INGEST_ROWS = Counter('ingest_rows_total', 'Rows imported', ['table'])
+INGEST_BYTES = Counter('ingest_bytes_total', 'Compressed bytes downloaded', ['table'])
+INGEST_ROWS_PER_SECOND = Gauge('ingest_rows_per_second', 'Import throughput of the last run', ['table', 'shard'])
+INGEST_BYTES_PER_SECOND = Gauge('ingest_bytes_per_second', 'Download throughput of the last run', ['table', 'shard'])
+
+# Substrate RPC
+RPC_LATENCY = Histogram('rpc_request_seconds', 'Latency of Substrate RPC calls', ['endpoint', 'call'])
+RPC_ERRORS = Counter('rpc_errors_total', 'Failed Substrate RPC connections', ['endpoint'])
+
+# Jobs
+JOB_RUNS = Counter('job_runs_total', 'Scheduled job runs', ['job', 'outcome'])
+JOB_DURATION = Histogram('job_duration_seconds', 'Duration of scheduled job runs', ['job'],
+                         buckets=(1, 5, 15, 60, 300, 900, 1800, 3600, 7200, 14400, 28800))
+
+# Bot
+OPENAI_FIRST_TOKEN = Histogram('openai_first_token_seconds', 'Time to first streamed token',
+                               buckets=(0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 20.0, 30.0, 60.0))
+OPENAI_TOTAL = Histogram('openai_response_seconds', 'Time to a completed assistant message',
+                         buckets=(0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0))
+TELEGRAM_EDIT_LATENCY = Histogram('telegram_edit_seconds', 'Latency of Telegram message edits')
+TELEGRAM_THROTTLED = Counter('telegram_throttled_total', 'Telegram RetryAfter responses', ['method'])
+
+# Startup
+STARTUP_SECONDS = Gauge('startup_seconds', 'Import and init time per component', ['component'])
+
+
+@contextmanager
+def timed(histogram, *labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(*labels).observe(time.perf_counter() - start)
+
+
+def checkout(pool, name):
+    """Get a connection from a psycopg2 pool, counting exhausted pools and failed connects."""
+    try:
+        return pool.getconn()
+    except psycopg2.pool.PoolError:
+        POOL_ERRORS.labels(name, 'exhausted').inc()
+        raise
+    except Exception:
+        POOL_ERRORS.labels(name, 'connect').inc()
+        raise
+
+
+def observe_ingest(table_name, shard, rows, size, seconds):
+    INGEST_ROWS.labels(table_name).inc(rows)
+    INGEST_BYTES.labels(table_name).inc(size)
+    if seconds > 0:
+        INGEST_ROWS_PER_SECOND.labels(table_name, shard).set(rows / seconds)
+        INGEST_BYTES_PER_SECOND.labels(table_name, shard).set(size / seconds)
+
+
+def serve(port=METRICS_PORT):
+    """Expose /metrics from a background thread, for roles that don't run the flask app."""
+    start_http_server(port)
+
+
+def install(app):
+    """Time every request of a flask app and expose /metrics."""
+    import flask
+
+    @app.before_request
+    def start_timer():
+        flask.g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_latency(response):
+        start = flask.g.pop('metrics_start', None)
+        if start is not None:
+            rule = flask.request.url_rule.rule if flask.request.url_rule else 'unmatched'
+            ROUTE_LATENCY.labels(rule, flask.request.method, response.status_code).observe(time.perf_counter() - start)
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return flask.Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
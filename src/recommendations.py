@@ -0,0 +1,181 @@
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+import accounts
+
+CLUSTERS = 8
+KMEANS_ITERATIONS = 20
+KMEANS_SAMPLE = 200000
+CHUNK_ROWS = 200000
+# how much a pool's distance from the nominator's profile costs against its quality
+DISTANCE_WEIGHT = 0.5
+# besides its own pools every cluster considers the pools closest to its centroid
+CLUSTER_CANDIDATES = 10
+SEED = 42
+
+TAGS = {'low activity': 0, 'moderate': 1, 'unstable': 2, 'stable': 3, 'top_performer': 4}
+RISKS = {'low stake': 0, 'low prob': 1, 'in risk': 2, 'low risk': 3}
+NUMERIC_FEATURES = ['currentStake', 'APY', 'activeValidators', 'validatorsCoverage', 'currentEraFee', 'activeEraSuccessRate']
+FEATURES = NUMERIC_FEATURES + ['tags', 'risks']
+
+FEATURES_QUERY = f"""
+COPY (
+    SELECT
+        encode(d.account_key, 'hex') AS account_key,
+        d.address,
+        {", ".join(f'd."{column}"' for column in FEATURES)},
+        COALESCE(d."activeNominator", '0') = '1' AS active,
+        p.account_key IS NOT NULL AS is_pool
+    FROM dashboard d
+    LEFT JOIN (SELECT DISTINCT account_key FROM pools) p ON p.account_key = d.account_key
+    WHERE d.account_key IS NOT NULL
+) TO STDOUT CSV HEADER
+"""
+
+
+def load_features(db):
+    """Read the dashboard features of every keyed address into a DataFrame through COPY."""
+    buffer = io.BytesIO()
+    with db.cursor() as cur:
+        cur.copy_expert(FEATURES_QUERY, buffer)
+    buffer.seek(0)
+    df = pd.read_csv(buffer, dtype={'account_key': str, 'address': str, 'tags': str, 'risks': str})
+    df['tags'] = df['tags'].map(TAGS)
+    df['risks'] = df['risks'].map(RISKS)
+    df['active'] = df['active'] == 't'
+    df['is_pool'] = df['is_pool'] == 't'
+    return df
+
+
+def standardize(df):
+    """Feature matrix with missing values at the column median and every column z-scored."""
+    X = df[FEATURES].to_numpy(dtype=np.float32, na_value=np.nan)
+    X[:, 0] = np.log1p(np.clip(X[:, 0], 0, None))
+    medians = np.nanmedian(X, axis=0)
+    medians = np.where(np.isnan(medians), 0, medians)
+    X = np.where(np.isnan(X), medians, X)
+    std = X.std(axis=0)
+    return (X - X.mean(axis=0)) / np.where(std > 0, std, 1)
+
+
+def nearest(X, centroids):
+    """Index of and squared distance to the closest centroid for every row, computed in chunks."""
+    labels = np.empty(len(X), dtype=np.int32)
+    distances = np.empty(len(X), dtype=np.float32)
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    for start in range(0, len(X), CHUNK_ROWS):
+        chunk = X[start:start + CHUNK_ROWS]
+        d = (chunk ** 2).sum(axis=1)[:, None] - 2 * chunk @ centroids.T + centroid_norms[None, :]
+        labels[start:start + CHUNK_ROWS] = d.argmin(axis=1)
+        distances[start:start + CHUNK_ROWS] = d.min(axis=1)
+    return labels, distances
+
+
+def kmeans(X, k=CLUSTERS, iterations=KMEANS_ITERATIONS, seed=SEED):
+    """Lloyd's k-means fitted on a sample, every row is then assigned to its closest centroid."""
+    rng = np.random.default_rng(seed)
+    sample = X[rng.choice(len(X), size=min(len(X), KMEANS_SAMPLE), replace=False)]
+    k = min(k, len(sample))
+    centroids = sample[rng.choice(len(sample), size=k, replace=False)]
+    for _ in range(iterations):
+        labels, _ = nearest(sample, centroids)
+        sums = np.stack([np.bincount(labels, weights=sample[:, j], minlength=k) for j in range(X.shape[1])], axis=1)
+        counts = np.bincount(labels, minlength=k)[:, None]
+        updated = np.where(counts > 0, sums / np.maximum(counts, 1), centroids).astype(np.float32)
+        if np.allclose(updated, centroids, atol=1e-4):
+            break
+        centroids = updated
+    labels, _ = nearest(X, centroids)
+    return labels, centroids
+
+
+def pool_quality(X):
+    """Higher APY, success rate, coverage and lower fees make a better pool."""
+    apy, coverage, fee, success = (FEATURES.index(column) for column in ('APY', 'validatorsCoverage', 'currentEraFee', 'activeEraSuccessRate'))
+    return X[:, apy] + 0.5 * X[:, success] + 0.25 * X[:, coverage] - 0.5 * X[:, fee]
+
+
+def best_pools(X, pools, quality):
+    """Index and score of the best of `pools` for every row: quality minus weighted distance from the row's profile."""
+    pool_norms = (pools ** 2).sum(axis=1)
+    best = np.empty(len(X), dtype=np.int64)
+    scores = np.empty(len(X), dtype=np.float32)
+    for start in range(0, len(X), CHUNK_ROWS):
+        chunk = X[start:start + CHUNK_ROWS]
+        distance = (chunk ** 2).sum(axis=1)[:, None] - 2 * chunk @ pools.T + pool_norms[None, :]
+        score = quality[None, :] - DISTANCE_WEIGHT * np.sqrt(np.maximum(distance, 0))
+        idx = score.argmax(axis=1)
+        best[start:start + CHUNK_ROWS] = idx
+        scores[start:start + CHUNK_ROWS] = score[np.arange(len(chunk)), idx]
+    return best, scores
+
+
+def recommend_pools(X, pool_rows, labels, centroids, candidates=CLUSTER_CANDIDATES):
+    """Best pool for every row among the pools of its cluster and the pools closest to the cluster's centroid."""
+    pools = X[pool_rows]
+    quality = pool_quality(pools)
+    pool_labels = labels[pool_rows]
+    centroid_distance = ((pools[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+    best = np.empty(len(X), dtype=np.int64)
+    scores = np.empty(len(X), dtype=np.float32)
+    for cluster in range(len(centroids)):
+        members = np.flatnonzero(labels == cluster)
+        if len(members) == 0:
+            continue
+        candidate = np.union1d(np.flatnonzero(pool_labels == cluster), np.argsort(centroid_distance[:, cluster])[:candidates])
+        idx, cluster_scores = best_pools(X[members], pools[candidate], quality[candidate])
+        best[members] = pool_rows[candidate[idx]]
+        scores[members] = cluster_scores
+    return best, scores
+
+
+def save_recommendations(db, keys, clusters, pool_keys, scores):
+    """Load the recommendations into a fresh table and swap it in so readers never see a partial result."""
+    buffer = io.StringIO()
+    buffer.write("".join(
+        f"\\x{key},{cluster},\\x{pool_key},{score:.4f}\n"
+        for key, cluster, pool_key, score in zip(keys, clusters.tolist(), pool_keys, scores.tolist())
+    ))
+    buffer.seek(0)
+    with db.cursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS recommendations_new")
+        cur.execute("""
+            CREATE TABLE recommendations_new (
+                account_key BYTEA NOT NULL,
+                cluster INTEGER,
+                pool_account_key BYTEA,
+                score REAL,
+                generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cur.copy_expert("COPY recommendations_new (account_key, cluster, pool_account_key, score) FROM STDIN CSV", buffer)
+        # building the key after the load is much faster than maintaining it during COPY
+        cur.execute("ALTER TABLE recommendations_new ADD PRIMARY KEY (account_key)")
+        cur.execute("DROP TABLE IF EXISTS recommendations")
+        cur.execute("ALTER TABLE recommendations_new RENAME TO recommendations")
+        cur.execute("ALTER INDEX recommendations_new_pkey RENAME TO recommendations_pkey")
+    db.commit()
+
+
+def run_recommendations(db):
+    """Cluster every nominator, pick a pool for each and persist the result, returns (rows, seconds)."""
+    start = time.perf_counter()
+    if not accounts.backfill_pool_keys(db):
+        return 0, time.perf_counter() - start
+    df = load_features(db)
+    df = df.drop_duplicates('account_key').reset_index(drop=True)
+    pool_rows = np.flatnonzero(df['is_pool'].to_numpy() & df['active'].to_numpy() & df['APY'].notna().to_numpy())
+    if len(df) == 0 or len(pool_rows) == 0:
+        return 0, time.perf_counter() - start
+
+    X = standardize(df)
+    labels, centroids = kmeans(X)
+    best, scores = recommend_pools(X, pool_rows, labels, centroids)
+
+    keys = df['account_key'].to_numpy()
+    save_recommendations(db, keys.tolist(), labels, keys[best].tolist(), scores)
+    return len(df), time.perf_counter() - start
+
@@ -0,0 +1,30 @@
+import time
+from contextlib import contextmanager
+
+# imported first by app.py so the total covers the whole startup
+STARTED = time.perf_counter()
+components = []
+
+
+@contextmanager
+def timed(component):
+    """Record how long importing or initializing a component took."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        components.append((component, time.perf_counter() - start))
+
+
+def report():
+    """Print the startup cost per component and in total, and export it as metrics."""
+    import metrics
+
+    total = time.perf_counter() - STARTED
+    lines = ["Startup report:"]
+    for component, seconds in components:
+        lines.append(f"  {component:<30} {seconds * 1000:8.1f} ms")
+        metrics.STARTUP_SECONDS.labels(component).set(seconds)
+    lines.append(f"  {'total':<30} {total * 1000:8.1f} ms")
+    metrics.STARTUP_SECONDS.labels('total').set(total)
+    print("\n".join(lines), flush=True)